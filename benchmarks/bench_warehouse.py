@@ -0,0 +1,256 @@
+"""
+End-to-end throughput/latency benchmark for `WarehouseManager`.
+
+Runs the order and machine paths against a temporary aiosqlite database with an
+in-process fake instead of RabbitMQ and prints one JSON report, so runs can be
+stored and compared over time:
+
+    python -m benchmarks.bench_warehouse --output bench.json
+    python -m benchmarks.bench_warehouse --scenario large-order-no-stock
+"""
+from .fakes import (
+    fake_connect,
+    FakeRabbitMQPublisher,
+    noop,
+)
+from dataclasses import (
+    asdict,
+    dataclass,
+)
+from datetime import (
+    datetime,
+    timezone,
+)
+from pathlib import Path
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+)
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+# The fakes must be in place before `warehouse` is imported, which binds the names:
+# setup_rabbitmq_logging (for the broker logging startup phase) and RabbitMQPublisher.
+import aio_pika
+import chassis.logging
+import chassis.messaging
+aio_pika.connect = fake_connect
+chassis.logging.setup_rabbitmq_logging = noop
+chassis.messaging.RabbitMQPublisher = FakeRabbitMQPublisher
+os.environ.setdefault("WAREHOUSE_CAPACITY", str(10**9))
+# Per-message INFO logs would dominate the timings and mix with the JSON report
+logging.disable(logging.INFO)
+
+from sqlalchemy import (
+    event,
+    insert,
+    select,
+)
+from sqlalchemy.ext.asyncio import (
+    async_sessionmaker,
+    AsyncEngine,
+    create_async_engine,
+)
+import chassis.sql
+from warehouse.business_logic import WarehouseManager
+from warehouse.global_vars import (
+    OUTBOX_CONFIG,
+    RABBITMQ_CONFIG,
+)
+from warehouse.messaging import OutboxRelay
+from warehouse.sql import (
+    Piece,
+    run_migrations,
+)
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    orders: int
+    order_size: int
+    piece_types: tuple[str, ...]
+    free_stock_per_type: int
+
+
+SCENARIOS: list[Scenario] = [
+    Scenario("small-orders-no-stock", orders=200, order_size=5, piece_types=("A",), free_stock_per_type=0),
+    Scenario("small-orders-mixed-types", orders=200, order_size=6, piece_types=("A", "B", "C"), free_stock_per_type=0),
+    Scenario("small-orders-full-stock", orders=200, order_size=5, piece_types=("A", "B"), free_stock_per_type=1000),
+    Scenario("large-order-no-stock", orders=5, order_size=500, piece_types=("A", "B"), free_stock_per_type=0),
+    Scenario("large-order-half-stock", orders=5, order_size=500, piece_types=("A", "B"), free_stock_per_type=625),
+]
+
+
+class QueryCounter:
+    """Counts the queries of the operations, leaving out the outbox relay's."""
+
+    def __init__(self, engine: AsyncEngine) -> None:
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args: Any) -> None:
+        task = asyncio.current_task()
+        if task is None or task.get_name() != OutboxRelay.TASK_NAME:
+            self.count += 1
+
+
+class OperationStats:
+    def __init__(self) -> None:
+        self.latencies: list[float] = []
+        self.queries = 0
+
+    def report(self) -> dict[str, float | int]:
+        if not self.latencies:
+            return {"calls": 0}
+        ordered = sorted(self.latencies)
+        total = sum(ordered)
+        return {
+            "calls": len(ordered),
+            "ops_per_s": round(len(ordered) / total, 2) if total > 0 else 0.0,
+            "p50_ms": round(statistics.median(ordered) * 1000, 3),
+            "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+            "queries": self.queries,
+            "queries_per_op": round(self.queries / len(ordered), 2),
+        }
+
+
+def _use_engine(engine: AsyncEngine) -> None:
+    """Point every loaded warehouse module (and chassis.sql) at the benchmark database."""
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    modules = [chassis.sql] + [
+        module for name, module in sys.modules.items()
+        if module is not None and (name == "warehouse" or name.startswith("warehouse."))
+    ]
+    for module in modules:
+        if hasattr(module, "SessionLocal"):
+            setattr(module, "SessionLocal", session_factory)
+        if hasattr(module, "Engine"):
+            setattr(module, "Engine", engine)
+
+
+async def _timed(
+    stats: OperationStats,
+    counter: QueryCounter,
+    operation: Callable[[], Awaitable[None]],
+) -> None:
+    queries_before = counter.count
+    started = time.perf_counter()
+    await operation()
+    stats.latencies.append(time.perf_counter() - started)
+    stats.queries += counter.count - queries_before
+
+
+async def _order_piece_ids(engine: AsyncEngine, order_id: int) -> list[int]:
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            select(Piece.id)
+                .where(Piece.order_id == order_id)
+                .where(Piece.status == Piece.STATUS_QUEUED)
+        )
+        return list(result.scalars())
+
+
+async def run_scenario(scenario: Scenario, workdir: Path) -> dict[str, Any]:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{workdir / (scenario.name + '.db')}")
+    _use_engine(engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(chassis.sql.Base.metadata.create_all)
+    await run_migrations(engine)
+    await WarehouseManager.create()
+
+    if scenario.free_stock_per_type > 0:
+        async with engine.begin() as conn:
+            await conn.execute(insert(Piece), [
+                {"order_id": None, "type": piece_type, "status": Piece.STATUS_PRODUCED}
+                for piece_type in scenario.piece_types
+                for _ in range(scenario.free_stock_per_type)
+            ])
+
+    FakeRabbitMQPublisher.reset()
+    # The relay publishes from its own task, as in the service, so operations are
+    # timed up to their commit
+    outbox_relay = OutboxRelay(RABBITMQ_CONFIG, OUTBOX_CONFIG)
+    outbox_relay.start()
+    counter = QueryCounter(engine)
+    stats = {
+        name: OperationStats()
+        for name in (
+            "produce_pieces",
+            "piece_producing",
+            "piece_produced",
+            "try_reserve_space",
+            "release_space",
+            "cancel_order",
+        )
+    }
+
+    per_type = scenario.order_size // len(scenario.piece_types)
+    order_ids = list(range(1, scenario.orders + 1))
+    for order_id in order_ids:
+        pieces = [{"type": piece_type, "quantity": per_type} for piece_type in scenario.piece_types]
+        await _timed(stats["produce_pieces"], counter, lambda: WarehouseManager.produce_pieces(order_id, pieces))
+
+    for order_id in order_ids:
+        piece_ids = await _order_piece_ids(engine, order_id)
+        for piece_id in piece_ids:
+            await _timed(stats["piece_producing"], counter, lambda: WarehouseManager.piece_producing(piece_id))
+        # Leave part of the order unproduced, so reservation also cancels queued pieces
+        for piece_id in piece_ids[:len(piece_ids) * 3 // 4]:
+            await _timed(stats["piece_produced"], counter, lambda: WarehouseManager.piece_produced(piece_id))
+
+    for order_id in order_ids:
+        await _timed(stats["try_reserve_space"], counter, lambda: WarehouseManager.try_reserve_space(order_id))
+    for order_id in order_ids:
+        await _timed(stats["release_space"], counter, lambda: WarehouseManager.release_space(order_id))
+    for order_id in order_ids:
+        await _timed(stats["cancel_order"], counter, lambda: WarehouseManager.cancel_order(order_id))
+
+    await outbox_relay.stop(timeout=60.0)
+    await engine.dispose()
+    return {
+        "scenario": asdict(scenario),
+        "published_messages": len(FakeRabbitMQPublisher.published),
+        "operations": {name: operation_stats.report() for name, operation_stats in stats.items()},
+    }
+
+
+async def main(scenarios: list[Scenario]) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="warehouse-bench-") as workdir:
+        results = [await run_scenario(scenario, Path(workdir)) for scenario in scenarios]
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "warehouse_env": {
+            name: value for name, value in sorted(os.environ.items())
+            if name.startswith(("MACHINE_", "WAREHOUSE_", "SQLITE_", "OUTBOX_"))
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=[scenario.name for scenario in SCENARIOS],
+        help="Scenario to run (repeatable, default: all)",
+    )
+    parser.add_argument("--output", type=Path, help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    selected = [scenario for scenario in SCENARIOS if not args.scenario or scenario.name in args.scenario]
+    report = json.dumps(asyncio.run(main(selected)), indent=2)
+    if args.output is not None:
+        args.output.write_text(report)
+    print(report)
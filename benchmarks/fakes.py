@@ -0,0 +1,73 @@
+from typing import Any
+import json
+
+class FakeRabbitMQPublisher:
+    """In-process stand-in for `chassis.messaging.RabbitMQPublisher`."""
+
+    published: list[tuple[dict[str, Any], Any]] = []
+
+    def __init__(self, queue: str, rabbitmq_config: Any, **publisher_args: Any) -> None:
+        self.target = {"queue": queue, **publisher_args}
+
+    def __enter__(self) -> "FakeRabbitMQPublisher":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> bool:
+        return False
+
+    def publish(self, message: Any) -> None:
+        FakeRabbitMQPublisher.published.append((self.target, message))
+
+    @classmethod
+    def reset(cls) -> None:
+        cls.published.clear()
+
+
+class FakeExchange:
+    """In-process stand-in for an aio-pika exchange, recording into the same list."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    async def publish(self, message: Any, routing_key: str) -> None:
+        FakeRabbitMQPublisher.published.append(
+            ({"exchange": self.name, "routing_key": routing_key}, json.loads(message.body))
+        )
+
+
+class FakeChannel:
+    """In-process stand-in for an aio-pika channel."""
+
+    is_closed = False
+
+    def __init__(self) -> None:
+        self.default_exchange = FakeExchange("")
+
+    async def declare_exchange(self, name: str, *args: Any, **kwargs: Any) -> FakeExchange:
+        return FakeExchange(name)
+
+    async def get_exchange(self, name: str, *args: Any, **kwargs: Any) -> FakeExchange:
+        return FakeExchange(name)
+
+    async def declare_queue(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+
+class FakeConnection:
+    """In-process stand-in for an aio-pika connection."""
+
+    is_closed = False
+
+    async def channel(self, *args: Any, **kwargs: Any) -> FakeChannel:
+        return FakeChannel()
+
+    async def close(self) -> None:
+        pass
+
+
+async def fake_connect(*args: Any, **kwargs: Any) -> FakeConnection:
+    return FakeConnection()
+
+
+def noop(*args: Any, **kwargs: Any) -> None:
+    pass
@@ -1,13 +1,25 @@
-from .business_logic import WarehouseManager
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from .business_logic import (
+    PIECE_ARCHIVER,
+    PROCESSED_MESSAGES,
+    PUBLISHER_POOL,
+    WarehouseManager,
+)
 from .global_vars import (
+    ASYNC_CONSUMER_CONFIG,
     LISTENING_QUEUES,
+    MACHINE_EVENT_BATCH_CONFIG,
+    OUTBOX_CONFIG,
     RABBITMQ_CONFIG,
+    RABBITMQ_CONSUMER_MODE,
+    SQLITE_CONFIG,
 )
 from chassis.logging import (
     get_logger,
     setup_rabbitmq_logging,
 )
-from chassis.messaging import start_rabbitmq_listener
 from chassis.consul import CONSUL_CLIENT
 from chassis.sql import (
     Base,
@@ -15,72 +27,209 @@ from chassis.sql import (
 )
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from hypercorn.asyncio import serve
-from hypercorn.config import Config
 from threading import Thread
+from typing import (
+    Optional,
+    TYPE_CHECKING,
+)
 import asyncio
+import importlib
 import logging.config
 import os
 import socket
 
 # Configure logging ################################################################################
+# Shipping records to RabbitMQ is set up by a background startup phase
 logging.config.fileConfig(
-    os.path.join(os.path.dirname(__file__), "logging.ini")
-)
-setup_rabbitmq_logging(
-    rabbitmq_config=RABBITMQ_CONFIG,
-    capture_dependencies=True,
+    os.path.join(os.path.dirname(__file__), "logging.ini"),
+    # The modules imported above already created their loggers
+    disable_existing_loggers=False,
 )
 logger = get_logger(__name__)
 
-from .routers import Router
-from .messaging import *
+from .health import HEALTH_PROBER
+from .log_pipeline import LOG_PIPELINES
+from .metrics import (
+    instrument_pool,
+    METRICS_SERVER,
+)
+from .routers import (
+    InventoryRouter,
+    Router,
+)
+from .security import PUBLIC_KEY_FETCHER
+from .sql import (
+    apply_sqlite_profile,
+    convert_auto_vacuum,
+    DB_WRITER,
+    run_migrations,
+)
+from .startup import STARTUP
+from .supervisor import (
+    SUPERVISOR,
+    WORKER_ROLE,
+)
+
+# The messaging package (handlers, consumers, outbox relay, aio-pika) is only imported by
+# the startup phase that needs it; chassis.messaging and pika are already loaded by then,
+# through global_vars and the publisher pool
+if TYPE_CHECKING:
+    from .messaging import (
+        AsyncQueueConsumer,
+        OutboxRelay,
+    )
 
 # App Lifespan #####################################################################################
+async def prepare_database() -> None:
+    """Create and migrate the schema and sync the warehouses; once per service."""
+    async with Engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await run_migrations(Engine)
+    await convert_auto_vacuum(Engine, SQLITE_CONFIG)
+    await WarehouseManager.create()
+
+async def register_in_consul() -> None:
+    await asyncio.to_thread(
+        CONSUL_CLIENT.register_service,
+        service_name="warehouse",
+        ec2_address=os.getenv("HOST_IP", socket.gethostbyname(socket.gethostname())),
+        service_port=int(os.getenv("HOST_PORT", 8000)),
+    )
+
 @asynccontextmanager
 async def lifespan(__app: FastAPI):
+    async_consumer: Optional["AsyncQueueConsumer"] = None
+    outbox_relay: Optional["OutboxRelay"] = None
+    # Queues whose consumer is running (or being started), so a retried phase skips them
+    consumed_queues: set[str] = set()
+    registers_in_consul = WORKER_ROLE.initializes and WORKER_ROLE.serves_http
+
+    async def setup_broker_logging() -> None:
+        # The broker handlers publish from their own pipeline thread, never from a handler
+        await asyncio.to_thread(
+            LOG_PIPELINES["broker"].adopt,
+            lambda: setup_rabbitmq_logging(
+                rabbitmq_config=RABBITMQ_CONFIG,
+                capture_dependencies=True,
+            ),
+        )
+
+    async def start_messaging() -> None:
+        # Retried by STARTUP until it succeeds: every step skips what an earlier attempt started
+        nonlocal outbox_relay
+        messaging = await asyncio.to_thread(importlib.import_module, f"{__name__}.messaging")
+        from chassis.messaging import start_rabbitmq_listener
+
+        if WORKER_ROLE.runs_singletons and outbox_relay is None:
+            relay = messaging.OutboxRelay(RABBITMQ_CONFIG, OUTBOX_CONFIG)
+            relay.start()
+            outbox_relay = relay
+
+        async_bindings = []
+        for _, queue in LISTENING_QUEUES.items():
+            if queue in consumed_queues:
+                continue
+            # Every process that verifies tokens needs the key rotation notices
+            if queue == LISTENING_QUEUES["public_key"]:
+                if not WORKER_ROLE.serves_http:
+                    continue
+            elif not WORKER_ROLE.consumes:
+                continue
+
+            if MACHINE_EVENT_BATCH_CONFIG["enabled"] and queue in messaging.BATCH_HANDLERS:
+                Thread(
+                    target=messaging.BatchingConsumer(
+                        binding=messaging.QUEUE_BINDINGS[queue],
+                        batch_handler=messaging.BATCH_HANDLERS[queue],
+                        rabbitmq_config=RABBITMQ_CONFIG,
+                        max_messages=MACHINE_EVENT_BATCH_CONFIG["max_messages"],
+                        max_wait_ms=MACHINE_EVENT_BATCH_CONFIG["max_wait_ms"],
+                    ).run,
+                    daemon=True,
+                ).start()
+            elif RABBITMQ_CONSUMER_MODE == "asyncio":
+                # Marked as consumed once the consumer phase is spawned, below
+                async_bindings.append(messaging.QUEUE_BINDINGS[queue])
+                continue
+            else:
+                Thread(
+                    target=start_rabbitmq_listener,
+                    args=(queue, RABBITMQ_CONFIG),
+                    daemon=True,
+                ).start()
+            consumed_queues.add(queue)
+
+        async def start_async_consumer() -> None:
+            nonlocal async_consumer
+            consumer = messaging.AsyncQueueConsumer(
+                RABBITMQ_CONFIG,
+                async_bindings,
+                ASYNC_CONSUMER_CONFIG,
+            )
+            try:
+                await consumer.start()
+            except Exception:
+                await consumer.stop()
+                raise
+            async_consumer = consumer
+
+        if async_bindings:
+            STARTUP.spawn("RabbitMQ asyncio consumer", start_async_consumer)
+            consumed_queues.update(binding.queue for binding in async_bindings)
+
     try:
-        logger.info("[LOG:WAREHOUSE] - Starting up")
+        logger.info(
+            "[LOG:WAREHOUSE] - Starting up: role=%s index=%s",
+            WORKER_ROLE.role,
+            WORKER_ROLE.index,
+        )
         try:
-            # Create DB tables
-            logger.info("[LOG:WAREHOUSE] - Creating database tables")
-            async with Engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
+            apply_sqlite_profile(Engine, SQLITE_CONFIG)
+            instrument_pool(Engine)
+            DB_WRITER.start()
+            # Requests cannot be served without the schema, everything else comes up in the background
+            if WORKER_ROLE.initializes:
+                await STARTUP.run("Database schema", prepare_database)
 
-            await WarehouseManager.create()
+            HEALTH_PROBER.start()
+            if (metrics_port := WORKER_ROLE.metrics_port) is not None:
+                STARTUP.spawn("Process metrics endpoint", lambda: METRICS_SERVER.start(metrics_port))
+            if WORKER_ROLE.runs_singletons:
+                PROCESSED_MESSAGES.start()
+                PIECE_ARCHIVER.start()
+            STARTUP.spawn("RabbitMQ logging", setup_broker_logging)
+            if WORKER_ROLE.serves_http:
+                STARTUP.spawn("Auth public key", PUBLIC_KEY_FETCHER.prefetch)
+            STARTUP.spawn("RabbitMQ listeners and outbox relay", start_messaging)
+            if registers_in_consul:
+                STARTUP.spawn("Consul registration", register_in_consul)
 
-            logger.info("[LOG:WAREHOUSE] - Starting RabbitMQ listeners")
-            try:
-                for _, queue in LISTENING_QUEUES.items():
-                    Thread(
-                        target=start_rabbitmq_listener,
-                        args=(queue, RABBITMQ_CONFIG),
-                        daemon=True,
-                    ).start()
-            except Exception as e:
-                logger.error(
-                    f"[LOG:WAREHOUSE] - Could not start RabbitMQ listeners: {e}",
-                    exc_info=True
-                )
-            logger.info("[LOG:WAREHOUSE] - Registering service to Consul")
-            try:
-                CONSUL_CLIENT.register_service(
-                    service_name="warehouse",
-                    ec2_address=os.getenv("HOST_IP", socket.gethostbyname(socket.gethostname())),
-                    service_port=int(os.getenv("HOST_PORT", 8000)),
-                )
-            except Exception as e:
-                logger.error(
-                    f"[LOG:WAREHOUSE] - Failed to register with Consul: {e}",
-                    exc_info=True
-                )
+            logger.info(
+                "[LOG:WAREHOUSE] - Ready to serve %.1fms after import",
+                (time.perf_counter() - _IMPORT_STARTED) * 1000,
+            )
             yield
         except Exception as e:
-            logger.error(f"[LOG:ORDER] - Could not create tables at startup: Reason={e}", exc_info=True)
+            logger.error("[LOG:WAREHOUSE] - Startup failed: reason=%s", e, exc_info=True)
     finally:
+        await STARTUP.stop()
+        if async_consumer is not None:
+            logger.info("[LOG:WAREHOUSE] - Draining RabbitMQ consumers")
+            await async_consumer.stop()
+        logger.info("[LOG:WAREHOUSE] - Closing RabbitMQ publishers")
+        if outbox_relay is not None:
+            await outbox_relay.stop()
+        PUBLISHER_POOL.close_all()
         logger.info("[LOG:WAREHOUSE] - Shutting down database")
+        await HEALTH_PROBER.stop()
+        await METRICS_SERVER.stop()
+        await PROCESSED_MESSAGES.stop()
+        await PIECE_ARCHIVER.stop()
+        await PUBLIC_KEY_FETCHER.stop()
+        await DB_WRITER.stop()
         await Engine.dispose()
-        CONSUL_CLIENT.deregister_service()
+        if registers_in_consul:
+            CONSUL_CLIENT.deregister_service()
 
 
 
@@ -119,20 +268,39 @@ APP = FastAPI(
 )
 
 APP.include_router(Router)
+APP.include_router(InventoryRouter)
 
 
 def start_server():
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
     config = Config()
     config.bind = [
         os.getenv("HOST", "0.0.0.0")
         + ":"
         + os.getenv("PORT", "8000")
     ]
-    config.workers = int(os.getenv("WORKERS", "1"))
+
+    if SUPERVISOR is not None:
+        async def initialize() -> None:
+            apply_sqlite_profile(Engine, SQLITE_CONFIG)
+            await prepare_database()
+
+        async def shutdown() -> None:
+            await Engine.dispose()
+            CONSUL_CLIENT.deregister_service()
+
+        logger.info(
+            "[LOG:WAREHOUSE] - Starting supervised Hypercorn servers on %s",
+            config.bind
+        )
+        asyncio.run(SUPERVISOR.run(config, initialize, register_in_consul, shutdown))
+        return
 
     logger.info(
         "[LOG:WAREHOUSE] - Starting Hypercorn server on %s",
         config.bind
     )
 
-    asyncio.run(serve(APP, config))  # type: ignore
\ No newline at end of file
+    asyncio.run(serve(APP, config))  # type: ignore
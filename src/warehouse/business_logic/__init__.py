@@ -1,5 +1,43 @@
+from .machine_dispatcher import (
+    MACHINE_DISPATCHER,
+    MachineDispatcher,
+)
+from .outbox import (
+    Outbox,
+    OUTBOX,
+)
+from .piece_archiver import (
+    PIECE_ARCHIVER,
+    PieceArchiver,
+)
+from .placement import (
+    SHARD_PLACEMENT,
+    ShardPlacement,
+)
+from .processed_messages import (
+    DuplicateMessage,
+    PROCESSED_MESSAGES,
+    ProcessedMessages,
+)
+from .publisher_pool import (
+    PUBLISHER_POOL,
+    PublisherPool,
+)
 from .warehouse_manager import WarehouseManager
 
 __all__: list[str] = [
+    "DuplicateMessage",
+    "MACHINE_DISPATCHER",
+    "MachineDispatcher",
+    "Outbox",
+    "OUTBOX",
+    "PIECE_ARCHIVER",
+    "PieceArchiver",
+    "PROCESSED_MESSAGES",
+    "ProcessedMessages",
+    "PUBLISHER_POOL",
+    "PublisherPool",
+    "SHARD_PLACEMENT",
+    "ShardPlacement",
     "WarehouseManager",
-]
\ No newline at end of file
+]
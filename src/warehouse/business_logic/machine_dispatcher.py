@@ -0,0 +1,90 @@
+from ..global_vars import (
+    MACHINE_CANCEL_CONFIG,
+    MACHINE_DISPATCH_CONFIG,
+    MachineCancelConfig,
+    MachineDispatchConfig,
+)
+from ..sql import OutboxEntry
+from collections import defaultdict
+
+class MachineDispatcher:
+    """
+    Builds the piece production requests and cancellations for the machines.
+
+    In "single" mode every piece is its own `machine.piece.produce.{type}` message.
+    In "batch" mode pieces of the same type travel together as
+    `{"piece_ids": [...], "piece_type": type}`, chunked to `batch_size`.
+    Cancellations go to the `machine_cancel` fanout the same way, per piece or as
+    `{"order_id": order_id, "piece_ids": [...]}`, with their own mode and size. The
+    messages are written to the outbox and published by the relay.
+    """
+
+    def __init__(self, config: MachineDispatchConfig, cancel_config: MachineCancelConfig) -> None:
+        self._mode = config["mode"]
+        self._batch_size = max(1, config["batch_size"])
+        self._cancel_mode = cancel_config["mode"]
+        self._cancel_batch_size = max(1, cancel_config["batch_size"])
+
+    @staticmethod
+    def _entry(piece_type: str, message: dict) -> OutboxEntry:
+        return {
+            "queue": "",
+            "publisher_args": {
+                "exchange": "machine",
+                "exchange_type": "topic",
+                "routing_key": f"machine.piece.produce.{piece_type}",
+                "auto_delete_queue": True,
+            },
+            "payload": message,
+            "call_site": "machine_dispatch",
+        }
+
+    def messages(self, pieces: list[tuple[int, str]]) -> list[OutboxEntry]:
+        if self._mode == "single":
+            return [
+                self._entry(piece_type, {
+                    "piece_id": piece_id,
+                    "piece_type": piece_type,
+                })
+                for piece_id, piece_type in pieces
+            ]
+
+        by_type: defaultdict[str, list[int]] = defaultdict(list)
+        for piece_id, piece_type in pieces:
+            by_type[piece_type].append(piece_id)
+        return [
+            self._entry(piece_type, {
+                "piece_ids": piece_ids[start:start + self._batch_size],
+                "piece_type": piece_type,
+            })
+            for piece_type, piece_ids in by_type.items()
+            for start in range(0, len(piece_ids), self._batch_size)
+        ]
+
+    @staticmethod
+    def _cancel_entry(message: dict) -> OutboxEntry:
+        return {
+            "queue": "",
+            "publisher_args": {
+                "exchange": "machine_cancel",
+                "exchange_type": "fanout",
+                "auto_delete_queue": True,
+            },
+            "payload": message,
+            "call_site": "machine_cancel",
+        }
+
+    def cancel_messages(self, order_id: int, piece_ids: list[int]) -> list[OutboxEntry]:
+        if self._cancel_mode == "single":
+            return [self._cancel_entry({"piece_id": piece_id}) for piece_id in piece_ids]
+
+        return [
+            self._cancel_entry({
+                "order_id": order_id,
+                "piece_ids": piece_ids[start:start + self._cancel_batch_size],
+            })
+            for start in range(0, len(piece_ids), self._cancel_batch_size)
+        ]
+
+
+MACHINE_DISPATCHER = MachineDispatcher(MACHINE_DISPATCH_CONFIG, MACHINE_CANCEL_CONFIG)
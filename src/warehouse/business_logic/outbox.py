@@ -0,0 +1,39 @@
+from ..sql import (
+    add_outbox_messages,
+    OutboxEntry,
+)
+from multiprocessing.synchronize import Event as ProcessEvent
+from sqlalchemy.ext.asyncio import AsyncSession
+from threading import Event
+
+class Outbox:
+    """
+    Messages stored in the same transaction as the state change they announce.
+
+    `add` stages them in the caller's session; once that transaction is committed,
+    `notify` wakes up the relay, which publishes and deletes them. A crash between
+    the commit and the publish only delays the messages, it cannot lose them.
+    """
+
+    def __init__(self) -> None:
+        self._pending: Event | ProcessEvent = Event()
+
+    @staticmethod
+    async def add(db: AsyncSession, entries: list[OutboxEntry]) -> None:
+        await add_outbox_messages(db, entries)
+
+    def share(self, event: ProcessEvent) -> None:
+        """Use an event shared between processes, so commits of the others wake up this relay."""
+        self._pending = event
+
+    def notify(self) -> None:
+        self._pending.set()
+
+    def wait(self, timeout: float) -> bool:
+        """Wait until `notify` is called or `timeout` seconds pass."""
+        notified = self._pending.wait(timeout)
+        self._pending.clear()
+        return notified
+
+
+OUTBOX = Outbox()
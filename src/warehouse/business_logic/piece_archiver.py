@@ -0,0 +1,127 @@
+from ..global_vars import (
+    PIECE_ARCHIVE_CONFIG,
+    PieceArchiveConfig,
+)
+from ..metrics import (
+    ARCHIVE_DURATION,
+    ARCHIVED_PIECES,
+)
+from ..sql import (
+    archive_pieces,
+    DB_WRITER,
+)
+from chassis.sql import Engine
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 'PRAGMA auto_vacuum' value of an incremental database
+_AUTO_VACUUM_INCREMENTAL = 2
+
+class PieceArchiver:
+    """
+    Keeps w_piece small by moving terminal pieces to w_piece_archive in the background.
+
+    Every `interval_s` it moves up to `max_batches` batches of `batch_size` pieces
+    (see `archive_pieces`), each batch in its own write transaction so the message
+    handlers get the writer in between. Every `vacuum_interval_s` it gives up to
+    `vacuum_pages` free pages of the SQLite file back to the filesystem.
+    """
+
+    def __init__(self, config: PieceArchiveConfig) -> None:
+        self.enabled = config["enabled"]
+        self._interval = config["interval_s"]
+        self._batch_size = max(1, config["batch_size"])
+        self._max_batches = max(1, config["max_batches"])
+        self._min_age = timedelta(seconds=config["min_age_s"])
+        self._vacuum_interval = config["vacuum_interval_s"]
+        self._vacuum_pages = max(0, config["vacuum_pages"])
+        self._last_vacuum = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+    async def archive(self) -> tuple[int, float]:
+        """Run one archiving pass and return the pieces moved and the seconds spent."""
+        started = time.perf_counter()
+        completed_before = datetime.now(timezone.utc).replace(tzinfo=None) - self._min_age
+
+        archived = 0
+        for _ in range(self._max_batches):
+            moved = await DB_WRITER.run(lambda db: archive_pieces(db, completed_before, self._batch_size))
+            archived += moved
+            if moved < self._batch_size:
+                break
+
+        elapsed = time.perf_counter() - started
+        ARCHIVED_PIECES.inc(amount=archived)
+        ARCHIVE_DURATION.observe(elapsed, "archive")
+        return archived, elapsed
+
+    @staticmethod
+    async def _auto_vacuum_mode() -> int:
+        async with Engine.connect() as conn:
+            return (await conn.execute(text("PRAGMA auto_vacuum"))).scalar_one()
+
+    async def vacuum(self) -> bool:
+        """Run 'PRAGMA incremental_vacuum'; False when the database cannot do it."""
+        if Engine.dialect.name != "sqlite":
+            return False
+        if await self._auto_vacuum_mode() != _AUTO_VACUUM_INCREMENTAL:
+            logger.warning(
+                "[LOG:ARCHIVER] - The database is not in auto_vacuum=INCREMENTAL mode "
+                "(see SQLITE_AUTO_VACUUM), skipping the incremental vacuum"
+            )
+            return False
+
+        async def incremental_vacuum(db: AsyncSession) -> None:
+            await db.execute(text(f"PRAGMA incremental_vacuum({self._vacuum_pages})"))
+            await db.commit()
+
+        started = time.perf_counter()
+        await DB_WRITER.run(incremental_vacuum)
+        ARCHIVE_DURATION.observe(time.perf_counter() - started, "vacuum")
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                archived, elapsed = await self.archive()
+                if archived > 0:
+                    logger.info(
+                        "[LOG:ARCHIVER] - Archived %d pieces in %.1fms",
+                        archived,
+                        elapsed * 1000,
+                    )
+                if time.monotonic() - self._last_vacuum >= self._vacuum_interval:
+                    self._last_vacuum = time.monotonic()
+                    await self.vacuum()
+            except Exception as e:
+                logger.error("[LOG:ARCHIVER] - Archiving failed: %s", e, exc_info=True)
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+PIECE_ARCHIVER = PieceArchiver(PIECE_ARCHIVE_CONFIG)
@@ -0,0 +1,45 @@
+from ..global_vars import (
+    WAREHOUSE_SHARD_CONFIG,
+    WarehouseShardConfig,
+)
+from typing import Optional
+import zlib
+
+class ShardPlacement:
+    """
+    Order in which the warehouses are tried when reserving space for an order.
+
+    "hash" starts at the warehouse picked by a stable hash of the order id and goes
+    around the others in id order, so an order always lands on the same warehouse
+    while it has room. "least-loaded" tries the warehouses with the most free space
+    first.
+
+    Within a warehouse an order reserves in the capacity stripe `order_id % stripes`,
+    so concurrent reservations spread over `stripes` counter rows.
+    """
+
+    def __init__(self, config: WarehouseShardConfig) -> None:
+        self.capacities = dict(config["capacities"])
+        self.policy = config["placement"]
+        self.stripes = config["stripes"]
+        self._warehouse_ids = sorted(self.capacities)
+
+    @property
+    def needs_load(self) -> bool:
+        return self.policy == "least-loaded"
+
+    def candidates(self, order_id: int, free_space: Optional[dict[int, int]] = None) -> list[int]:
+        if self.needs_load and free_space is not None:
+            return sorted(
+                self._warehouse_ids,
+                key=lambda warehouse_id: (-free_space.get(warehouse_id, 0), warehouse_id),
+            )
+
+        start = zlib.crc32(str(order_id).encode()) % len(self._warehouse_ids)
+        return self._warehouse_ids[start:] + self._warehouse_ids[:start]
+
+    def stripe(self, order_id: int) -> int:
+        return order_id % self.stripes
+
+
+SHARD_PLACEMENT = ShardPlacement(WAREHOUSE_SHARD_CONFIG)
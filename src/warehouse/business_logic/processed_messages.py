@@ -0,0 +1,184 @@
+from ..global_vars import (
+    IDEMPOTENCY_CONFIG,
+    IdempotencyConfig,
+)
+from ..metrics import IDEMPOTENCY_LOOKUPS
+from ..sql import (
+    add_processed_messages,
+    DB_WRITER,
+    delete_processed_messages,
+    get_processed_messages,
+    WriteOperation,
+)
+from chassis.sql import SessionLocal
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from threading import Lock
+from typing import (
+    Iterator,
+    Optional,
+    TypeVar,
+)
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class DuplicateMessage(Exception):
+    """The keys being recorded were committed meanwhile by another delivery of the message."""
+
+
+@dataclass
+class _Handling:
+    keys: list[str]
+    recorded: bool = False
+
+_HANDLING: ContextVar[Optional[_Handling]] = ContextVar("handling", default=None)
+
+
+class ProcessedMessages:
+    """
+    Idempotency keys of the messages that were already handled.
+
+    `lookup` checks an in-memory LRU first and w_processed_message only for the keys
+    it does not hold, so a redelivered message is recognized before its handler
+    does any work, also after a restart. The keys of the message being handled
+    (see `handling`) are recorded by `run`, in the transaction of the state change
+    they guard: they are committed with it or not at all, and a delivery racing
+    another one fails on the key instead of applying the message twice. Keys expire
+    after `ttl_s` and the expired rows are pruned in the background.
+    """
+
+    def __init__(self, config: IdempotencyConfig) -> None:
+        self._max_entries = max(0, config["cache_max_entries"])
+        self._ttl = timedelta(seconds=config["ttl_s"])
+        self._prune_interval = config["prune_interval_s"]
+        # Handlers of the thread consumers run on their own event loops
+        self._lock = Lock()
+        # key -> processed_at
+        self._cache: OrderedDict[str, datetime] = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    def _expired(self, processed_at: datetime, now: datetime) -> bool:
+        return processed_at < now - self._ttl
+
+    def _remember(self, keys: list[str], processed_at: datetime) -> None:
+        if self._max_entries == 0:
+            return
+        with self._lock:
+            for key in keys:
+                self._cache[key] = processed_at
+                self._cache.move_to_end(key)
+            while len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+
+    def _cached(self, keys: list[str], now: datetime) -> set[str]:
+        found: set[str] = set()
+        with self._lock:
+            for key in keys:
+                if (processed_at := self._cache.get(key)) is None:
+                    continue
+                if self._expired(processed_at, now):
+                    del self._cache[key]
+                    continue
+                self._cache.move_to_end(key)
+                found.add(key)
+        return found
+
+    async def lookup(self, keys: list[str]) -> set[str]:
+        """The keys that were processed already; the keys left out are new."""
+        now = _utcnow()
+        found = self._cached(keys, now)
+        IDEMPOTENCY_LOOKUPS.inc("memory", amount=len(found))
+
+        if (missing_keys := [key for key in keys if key not in found]):
+            async with SessionLocal() as db:
+                recorded = await get_processed_messages(db, missing_keys, now - self._ttl)
+            recorded_keys = {
+                key for key, processed_at in recorded.items()
+                if not self._expired(processed_at, now)
+            }
+            IDEMPOTENCY_LOOKUPS.inc("database", amount=len(recorded_keys))
+            IDEMPOTENCY_LOOKUPS.inc("new", amount=len(missing_keys) - len(recorded_keys))
+            found |= recorded_keys
+        return found
+
+    @contextmanager
+    def handling(self, keys: list[str]) -> Iterator[None]:
+        """Have the next `run` of this context record `keys`."""
+        token = _HANDLING.set(_Handling(keys))
+        try:
+            yield
+        finally:
+            _HANDLING.reset(token)
+
+    async def run(self, operation: WriteOperation[T]) -> T:
+        """
+        `DB_WRITER.run(operation)`, also recording the keys of the message being
+        handled, if any, in the same transaction.
+        """
+        if (handling := _HANDLING.get()) is None or handling.recorded:
+            return await DB_WRITER.run(operation)
+
+        keys = handling.keys
+        processed_at = _utcnow()
+
+        async def recorded(db: AsyncSession) -> T:
+            result = await operation(db)
+            await add_processed_messages(db, keys, processed_at)
+            return result
+
+        try:
+            result = await DB_WRITER.run(recorded)
+        except IntegrityError as e:
+            if await self.lookup(keys):
+                raise DuplicateMessage(*keys) from e
+            raise
+        handling.recorded = True
+        self._remember(keys, processed_at)
+        return result
+
+    async def prune(self) -> int:
+        """Delete the keys older than `ttl_s` and return how many there were."""
+        processed_before = _utcnow() - self._ttl
+        return await DB_WRITER.run(lambda db: delete_processed_messages(db, processed_before))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if (pruned := await self.prune()) > 0:
+                    logger.info("[LOG:IDEMPOTENCY] - Pruned %d expired idempotency keys", pruned)
+            except Exception as e:
+                logger.error("[LOG:IDEMPOTENCY] - Pruning idempotency keys failed: %s", e, exc_info=True)
+            await asyncio.sleep(self._prune_interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+PROCESSED_MESSAGES = ProcessedMessages(IDEMPOTENCY_CONFIG)
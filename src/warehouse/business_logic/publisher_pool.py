@@ -0,0 +1,129 @@
+from ..global_vars import RABBITMQ_CONFIG
+from ..metrics import (
+    PUBLISH_DURATION,
+    PUBLISH_FAILURES,
+)
+from chassis.messaging import (
+    MessageType,
+    RabbitMQConfig,
+    RabbitMQPublisher,
+)
+from threading import (
+    current_thread,
+    Lock,
+    local,
+    Thread,
+)
+from typing import (
+    Any,
+    Hashable,
+)
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class PublisherPool:
+    """
+    Keeps RabbitMQ publishers open between messages.
+
+    A publisher is opened the first time a target (queue, exchange, routing key...)
+    is used and reused afterwards, so connection, channel and exchange declaration
+    are paid once. pika connections are not thread safe, so every listener thread
+    gets its own set of publishers, and only its owner (or anyone, once the owner
+    has exited) may close them.
+    """
+
+    def __init__(self, rabbitmq_config: RabbitMQConfig) -> None:
+        self._rabbitmq_config = rabbitmq_config
+        self._local = local()
+        self._lock = Lock()
+        self._all_publishers: list[tuple[Thread, dict[Hashable, RabbitMQPublisher]]] = []
+
+    def _publishers(self) -> dict[Hashable, RabbitMQPublisher]:
+        publishers = getattr(self._local, "publishers", None)
+        if publishers is None:
+            publishers = {}
+            self._local.publishers = publishers
+            with self._lock:
+                self._all_publishers.append((current_thread(), publishers))
+        return publishers
+
+    def _open(self, queue: str, publisher_args: dict[str, Any]) -> RabbitMQPublisher:
+        publisher = RabbitMQPublisher(
+            queue=queue,
+            rabbitmq_config=self._rabbitmq_config,
+            **publisher_args,
+        )
+        publisher.__enter__()
+        return publisher
+
+    @staticmethod
+    def _close(publisher: RabbitMQPublisher) -> None:
+        try:
+            publisher.__exit__(None, None, None)
+        except Exception as e:
+            logger.debug("[LOG:PUBLISHER_POOL] - Error closing publisher: %s", e)
+
+    def publish(
+        self,
+        message: MessageType,
+        queue: str = "",
+        *,
+        call_site: str = "unknown",
+        **publisher_args: Any,
+    ) -> None:
+        key = (queue, tuple(sorted(publisher_args.items())))
+        publishers = self._publishers()
+        started = time.perf_counter()
+
+        for attempt in range(2):
+            try:
+                if (publisher := publishers.get(key)) is None:
+                    publisher = publishers[key] = self._open(queue, publisher_args)
+                publisher.publish(message)
+                PUBLISH_DURATION.observe(time.perf_counter() - started, call_site)
+                return
+            except Exception as e:
+                if (broken_publisher := publishers.pop(key, None)) is not None:
+                    self._close(broken_publisher)
+                if attempt == 1:
+                    PUBLISH_FAILURES.inc(call_site)
+                    raise
+                logger.warning(
+                    "[LOG:PUBLISHER_POOL] - Publish failed, reconnecting: target=%s, reason=%s",
+                    key,
+                    e,
+                )
+
+    def close_all(self) -> None:
+        """
+        Close the publishers of the calling thread and of the threads that have
+        exited. Those of live threads are left to them: closing a pika connection
+        from another thread is not safe, and they go away with the process.
+        """
+        caller = current_thread()
+        with self._lock:
+            closable = [
+                publishers for owner, publishers in self._all_publishers
+                if owner is caller or not owner.is_alive()
+            ]
+            self._all_publishers = [
+                (owner, publishers) for owner, publishers in self._all_publishers
+                if owner is not caller and owner.is_alive()
+            ]
+            still_open = sum(len(publishers) for _, publishers in self._all_publishers)
+        # A later publish from this thread registers a new set
+        self._local.publishers = None
+        for publishers in closable:
+            for publisher in publishers.values():
+                self._close(publisher)
+            publishers.clear()
+        if still_open > 0:
+            logger.debug(
+                "[LOG:PUBLISHER_POOL] - Left %d publishers of running threads open",
+                still_open,
+            )
+
+
+PUBLISHER_POOL = PublisherPool(RABBITMQ_CONFIG)
@@ -1,20 +1,32 @@
-from ..global_vars import RABBITMQ_CONFIG
+from .machine_dispatcher import MACHINE_DISPATCHER
+from .outbox import OUTBOX
+from .placement import SHARD_PLACEMENT
+from .processed_messages import PROCESSED_MESSAGES
 from ..sql import (
     cancel_queued_pieces_in_order,
-    create_piece,
+    claim_free_pieces,
+    count_pieces_by_status,
+    create_pieces,
     create_warehouse,
     derregister_active_pieces_from_order,
-    get_free_pieces,
-    get_piece,
-    get_pieces_by_order,
-    get_warehouse,
+    get_capacity_usage,
+    get_order_progress,
+    get_reservation,
+    get_warehouses,
+    mark_order_completed,
+    mark_piece_produced,
+    mark_piece_producing,
+    mark_pieces_produced,
+    mark_pieces_producing,
+    DB_WRITER,
     OrderPieceSchema,
+    OutboxEntry,
     Piece,
-    release_pieces,
-    reserve_pieces,
-    update_piece,
+    rebalance_capacity_stripes,
+    release_order_pieces,
+    reserve_order_pieces,
+    update_warehouse_capacity,
 )
-from chassis.messaging import RabbitMQPublisher
 from chassis.sql import SessionLocal
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import (
@@ -22,7 +34,6 @@ from typing import (
     TypeVar,
 )
 import logging
-import os
 
 logger = logging.getLogger(__name__)
 
@@ -30,8 +41,6 @@ WarehouseManagerType = TypeVar("WarehouseManagerType", bound="WarehouseManager")
 
 class WarehouseManager:
     """"""
-    WAREHOUSE_ID = 1
-    MAX_CAPACITY = int(os.getenv("WAREHOUSE_CAPACITY", "1000"))
 
     def __init__(self) -> None:
         pass
@@ -39,138 +48,155 @@ class WarehouseManager:
     @classmethod
     async def create(cls: Type[WarehouseManagerType]) -> None:
         async with SessionLocal() as db:
-            warehouse = await get_warehouse(db, WarehouseManager.WAREHOUSE_ID)
-            if warehouse is None:
-                warehouse = await create_warehouse(db, WarehouseManager.WAREHOUSE_ID)
-
-    @staticmethod
-    def _ask_piece(piece_id: int, piece_type: str) -> None:
-        with RabbitMQPublisher(
-            queue="",
-            rabbitmq_config=RABBITMQ_CONFIG,
-            exchange="machine",
-            exchange_type="topic",
-            routing_key=f"machine.piece.produce.{piece_type}",
-            auto_delete_queue=True,
-        ) as publisher:
-            publisher.publish({
-                "piece_id": piece_id,
-                "piece_type": piece_type,
-            })
+            warehouses = {warehouse.id: warehouse for warehouse in await get_warehouses(db)}
+            for warehouse_id, capacity in SHARD_PLACEMENT.capacities.items():
+                if (warehouse := warehouses.get(warehouse_id)) is None:
+                    await create_warehouse(db, warehouse_id, capacity)
+                elif warehouse.capacity != capacity:
+                    await update_warehouse_capacity(db, warehouse_id, capacity)
+                # Also re-spreads the free space when the number of stripes changed
+                await rebalance_capacity_stripes(db, warehouse_id, SHARD_PLACEMENT.stripes)
 
     @staticmethod
     async def _cancel_queued(order_id: int) -> None:
-        async with SessionLocal() as db:           
-            canceled_pieces = await cancel_queued_pieces_in_order(db, order_id)
-            for piece in canceled_pieces:
-                await WarehouseManager._send_cancel_piece(piece)
+        async def cancel_queued(db: AsyncSession) -> int:
+            cancelled_pieces = await cancel_queued_pieces_in_order(db, order_id)
+            await OUTBOX.add(db, MACHINE_DISPATCHER.cancel_messages(
+                order_id, [piece.id for piece in cancelled_pieces]
+            ))
+            return len(cancelled_pieces)
 
-    @staticmethod
-    async def _create_piece_entry(order_id: int, piece_type: str) -> int:
-        async with SessionLocal() as db:
-            piece = await create_piece(db, order_id, piece_type)
-            return piece.id
+        if await DB_WRITER.run(cancel_queued) > 0:
+            OUTBOX.notify()
 
     @staticmethod
-    async def _is_order_completed(db: AsyncSession, order_id: int) -> bool:
-        logger.info("is_completed??")
-        pieces = await get_pieces_by_order(db, order_id)
-        logger.info(f"ORDER_COMPLETION - pieces={pieces}")
-        return all(piece.status == Piece.STATUS_PRODUCED for piece in pieces)
+    async def _reserve_in_warehouse(db: AsyncSession, warehouse_id: int, order_id: int) -> bool:
+        stripe = SHARD_PLACEMENT.stripe(order_id)
+        if await reserve_order_pieces(db, warehouse_id, stripe, order_id):
+            return True
+
+        # The stripe is full: move free space of the warehouse into it and retry once
+        piece_counts = await count_pieces_by_status(db, order_id)
+        needed = piece_counts.get(Piece.STATUS_PRODUCED, 0) + piece_counts.get(Piece.STATUS_PRODUCING, 0)
+        if not await rebalance_capacity_stripes(db, warehouse_id, SHARD_PLACEMENT.stripes, stripe, needed):
+            return False
+        return await reserve_order_pieces(db, warehouse_id, stripe, order_id)
 
     @staticmethod
-    def _notify_order_completion(order_id: int) -> None:
-        with RabbitMQPublisher(
-            queue="order.status.update",
-            rabbitmq_config=RABBITMQ_CONFIG,
-        ) as publisher:
-            publisher.publish({
+    def _order_completion_message(order_id: int) -> OutboxEntry:
+        return {
+            "queue": "order.status.update",
+            "publisher_args": {},
+            "payload": {
                 "order_id": order_id,
                 "status": "Processed"
-            })
+            },
+            "call_site": "order_completion",
+        }
 
     @staticmethod
-    async def _reallocate_pieces(order_id: int, piece_type: str, quantity: int) -> int:
-        async with SessionLocal() as db:
-            free_pieces = await get_free_pieces(db, piece_type, quantity)
-            free_piece_ids = [piece.id for piece in free_pieces]
-            for free_piece_id in free_piece_ids:
-                assert (free_piece := await get_piece(db, free_piece_id)) is not None, "Piece should exist."
-                assert (await update_piece(db, free_piece, order_id=order_id)) is not None, "Should update an existing piece"
-        return len(free_pieces)
-    
-    @staticmethod
-    async def _send_cancel_piece(piece: Piece) -> None:
-        with RabbitMQPublisher(
-            queue="",
-            rabbitmq_config=RABBITMQ_CONFIG,
-            exchange="machine_cancel",
-            exchange_type="fanout",
-            auto_delete_queue=True,
-        ) as publisher:
-            publisher.publish({
-                "piece_id": piece.id,
-            })
+    async def _reallocate_pieces(db: AsyncSession, order_id: int, piece_type: str, quantity: int) -> int:
+        claimed_piece_ids = await claim_free_pieces(db, order_id, piece_type, quantity)
+        return len(claimed_piece_ids)
 
     @staticmethod
     async def cancel_order(order_id: int) -> None:
-        async with SessionLocal() as db:
-            await derregister_active_pieces_from_order(db, order_id)
+        await PROCESSED_MESSAGES.run(lambda db: derregister_active_pieces_from_order(db, order_id))
 
     @staticmethod
     async def piece_produced(piece_id: int) -> None:
-        async with SessionLocal() as db:
-            assert (piece := await get_piece(db, piece_id)) is not None, "Piece should exist"
-            assert (await update_piece(db, piece, status=Piece.STATUS_PRODUCED)) is not None, "Should update an existing piece"
+        async def produced(db: AsyncSession) -> bool:
+            order_progress = await mark_piece_produced(db, piece_id)
+            if order_progress is None:
+                return False
 
-            if piece.order_id is None:
-                return
+            order_id, outstanding = order_progress
+            if outstanding != 0:
+                return False
+            await OUTBOX.add(db, [WarehouseManager._order_completion_message(order_id)])
+            return True
 
-            if await WarehouseManager._is_order_completed(db, piece.order_id):
-                WarehouseManager._notify_order_completion(piece.order_id)
+        if await PROCESSED_MESSAGES.run(produced):
+            OUTBOX.notify()
 
     @staticmethod
     async def piece_producing(piece_id: int) -> None:
-        async with SessionLocal() as db:
-            assert (piece := await get_piece(db, piece_id)) is not None, "Piece should exist"
-            assert (await update_piece(db, piece, status=Piece.STATUS_PRODUCING)) is not None, "Should update an existing piece"
+        await PROCESSED_MESSAGES.run(lambda db: mark_piece_producing(db, piece_id))
 
     @staticmethod
-    async def produce_pieces(order_id: int, pieces: list[OrderPieceSchema]) -> None:
-        total_missing = 0
-
-        for piece_type in pieces:
-            reused_piece_count = await WarehouseManager._reallocate_pieces(
-                order_id=order_id, 
-                piece_type=piece_type["type"],
-                quantity=piece_type["quantity"],
-            )
+    async def pieces_produced(piece_ids: list[int]) -> None:
+        async def produced(db: AsyncSession) -> bool:
+            completion_messages = [
+                WarehouseManager._order_completion_message(order_id)
+                for order_id, outstanding in await mark_pieces_produced(db, piece_ids)
+                if outstanding == 0
+            ]
+            await OUTBOX.add(db, completion_messages)
+            return len(completion_messages) > 0
+
+        if await PROCESSED_MESSAGES.run(produced):
+            OUTBOX.notify()
 
-            missing_pieces = piece_type["quantity"] - reused_piece_count
+    @staticmethod
+    async def pieces_producing(piece_ids: list[int]) -> None:
+        await PROCESSED_MESSAGES.run(lambda db: mark_pieces_producing(db, piece_ids))
 
-            for _ in range(missing_pieces):
-                WarehouseManager._ask_piece(
-                    piece_id=await WarehouseManager._create_piece_entry(order_id, piece_type["type"]),
+    @staticmethod
+    async def produce_pieces(order_id: int, pieces: list[OrderPieceSchema]) -> None:
+        async def produce(db: AsyncSession) -> bool:
+            # The progress of the order means this request was handled before (a
+            # repeat the idempotency key did not catch, e.g. with another message_id)
+            if await get_order_progress(db, order_id) is not None:
+                return False
+
+            missing_piece_types: list[str] = []
+
+            for piece_type in pieces:
+                reused_piece_count = await WarehouseManager._reallocate_pieces(
+                    db=db,
+                    order_id=order_id,
                     piece_type=piece_type["type"],
+                    quantity=piece_type["quantity"],
                 )
 
-            total_missing += missing_pieces
+                missing_pieces = piece_type["quantity"] - reused_piece_count
+                missing_piece_types.extend([piece_type["type"]] * missing_pieces)
 
-        if total_missing == 0:
-            WarehouseManager._notify_order_completion(order_id)
+            if len(missing_piece_types) == 0:
+                await mark_order_completed(db, order_id)
+                await OUTBOX.add(db, [WarehouseManager._order_completion_message(order_id)])
+                return True
+
+            created_pieces = await create_pieces(db, order_id, missing_piece_types)
+            await OUTBOX.add(db, MACHINE_DISPATCHER.messages(created_pieces))
+            return True
+
+        if await PROCESSED_MESSAGES.run(produce):
+            OUTBOX.notify()
 
     @staticmethod
     async def release_space(order_id: int) -> None:
-        async with SessionLocal() as db:
-            all_pieces = await get_pieces_by_order(db, order_id)
-            active_piece_count = sum(1 for piece in all_pieces if piece.status in [Piece.STATUS_PRODUCED, Piece.STATUS_PRODUCING])
-            await release_pieces(db, WarehouseManager.WAREHOUSE_ID, active_piece_count)
+        warehouse_id = await PROCESSED_MESSAGES.run(lambda db: release_order_pieces(db, order_id))
+        if warehouse_id is None:
+            logger.warning("[LOG:WAREHOUSE] - No reservation to release: order_id=%s", order_id)
 
     @staticmethod
-    async def try_reserve_space(order_id: int) -> None:
+    async def try_reserve_space(order_id: int) -> int:
+        """Reserve the space of an order in the first warehouse with room and return its id."""
         await WarehouseManager._cancel_queued(order_id)
 
-        async with SessionLocal() as db:
-            all_pieces = await get_pieces_by_order(db, order_id)
-            active_pieces_count = sum(1 for piece in all_pieces if piece.status in [Piece.STATUS_PRODUCED, Piece.STATUS_PRODUCING])
-            await reserve_pieces(db, WarehouseManager.WAREHOUSE_ID, active_pieces_count, WarehouseManager.MAX_CAPACITY)
\ No newline at end of file
+        async def reserve(db: AsyncSession) -> int:
+            # A redelivered command must not reserve twice
+            if (reservation := await get_reservation(db, order_id)) is not None:
+                return reservation.warehouse_id
+
+            free_space = {
+                warehouse_id: capacity - reserved
+                for warehouse_id, capacity, reserved in await get_capacity_usage(db)
+            } if SHARD_PLACEMENT.needs_load else None
+            for warehouse_id in SHARD_PLACEMENT.candidates(order_id, free_space):
+                if await WarehouseManager._reserve_in_warehouse(db, warehouse_id, order_id):
+                    return warehouse_id
+            raise ValueError("Warehouse capacity exceeded")
+
+        return await PROCESSED_MESSAGES.run(reserve)
@@ -2,8 +2,10 @@ from chassis.messaging import RabbitMQConfig
 from pathlib import Path
 from typing import (
     Dict,
+    Literal,
     LiteralString,
     Optional,
+    TypedDict,
 )
 import os
 import socket
@@ -19,6 +21,247 @@ RABBITMQ_CONFIG: RabbitMQConfig = {
     "client_key": Path(client_key_path) if (client_key_path := os.getenv("RABBITMQ_CLIENT_KEY_PATH")) else None,
     "prefetch_count": int(os.getenv("RABBITMQ_PREFETCH_COUNT", 10)),
 }
+
+# "thread": one chassis listener thread per queue, "asyncio": aio-pika on the app event loop
+RABBITMQ_CONSUMER_MODE: Literal["thread", "asyncio"] = (
+    "asyncio" if os.getenv("RABBITMQ_CONSUMER_MODE", "thread") == "asyncio" else "thread"
+)
+
+class AsyncConsumerConfig(TypedDict):
+    max_retries: int
+
+# A message whose handler fails on the asyncio consumer is published to its queue again up
+# to 'max_retries' times, then rejected: dead-lettered if the queue has a dead-letter
+# exchange, dropped otherwise
+ASYNC_CONSUMER_CONFIG: AsyncConsumerConfig = {
+    "max_retries": max(0, int(os.getenv("RABBITMQ_CONSUMER_MAX_RETRIES", "3"))),
+}
+
+class SQLiteConfig(TypedDict):
+    auto_vacuum: str
+    journal_mode: str
+    synchronous: str
+    busy_timeout_ms: int
+    mmap_size: int
+    cache_size: int
+    group_commit: bool
+    group_commit_max_batch: int
+    group_commit_max_wait_ms: int
+
+# Pragmas applied on every new SQLite connection, plus the single-writer group commit
+SQLITE_CONFIG: SQLiteConfig = {
+    # Takes effect on a new database file; an existing one is vacuumed once at startup
+    "auto_vacuum": os.getenv("SQLITE_AUTO_VACUUM", "INCREMENTAL"),
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout_ms": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Negative values are KiB, as in 'PRAGMA cache_size'
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+    "group_commit": bool(int(os.getenv("SQLITE_GROUP_COMMIT", "0"))),
+    "group_commit_max_batch": int(os.getenv("SQLITE_GROUP_COMMIT_MAX_BATCH", "64")),
+    "group_commit_max_wait_ms": int(os.getenv("SQLITE_GROUP_COMMIT_MAX_WAIT_MS", "2")),
+}
+
+class MachineDispatchConfig(TypedDict):
+    mode: Literal["single", "batch"]
+    batch_size: int
+
+MACHINE_DISPATCH_CONFIG: MachineDispatchConfig = {
+    # "single": one message per piece, "batch": one message per piece type with a list of ids
+    "mode": "batch" if os.getenv("MACHINE_DISPATCH_MODE", "single") == "batch" else "single",
+    "batch_size": int(os.getenv("MACHINE_DISPATCH_BATCH_SIZE", "100")),
+}
+
+class MachineCancelConfig(TypedDict):
+    mode: Literal["single", "batch"]
+    batch_size: int
+
+MACHINE_CANCEL_CONFIG: MachineCancelConfig = {
+    # "single": one message per piece, "batch": one message per order with a list of ids
+    "mode": "batch" if os.getenv("MACHINE_CANCEL_MODE", "single") == "batch" else "single",
+    "batch_size": int(os.getenv("MACHINE_CANCEL_BATCH_SIZE", "500")),
+}
+
+class OutboxConfig(TypedDict):
+    batch_size: int
+    poll_interval_ms: int
+
+# The relay is woken up by every commit that adds messages; polling only picks up
+# messages left behind by a previous process
+OUTBOX_CONFIG: OutboxConfig = {
+    "batch_size": int(os.getenv("OUTBOX_BATCH_SIZE", "200")),
+    "poll_interval_ms": int(os.getenv("OUTBOX_POLL_INTERVAL_MS", "1000")),
+}
+
+class HealthProbeConfig(TypedDict):
+    interval_ms: int
+    timeout_ms: int
+    max_age_ms: int
+
+# /health serves the last background probe; older snapshots count as unhealthy
+HEALTH_PROBE_CONFIG: HealthProbeConfig = {
+    "interval_ms": int(os.getenv("HEALTH_PROBE_INTERVAL_MS", "5000")),
+    "timeout_ms": int(os.getenv("HEALTH_PROBE_TIMEOUT_MS", "2000")),
+    "max_age_ms": int(os.getenv("HEALTH_PROBE_MAX_AGE_MS", "30000")),
+}
+
+class JWTVerifierConfig(TypedDict):
+    algorithms: list[str]
+    cache_max_entries: int
+    cache_ttl_s: int
+
+# Verified tokens are cached until their 'exp', and never longer than 'cache_ttl_s'
+JWT_VERIFIER_CONFIG: JWTVerifierConfig = {
+    "algorithms": os.getenv("JWT_ALGORITHMS", "RS256").split(","),
+    "cache_max_entries": int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000")),
+    "cache_ttl_s": int(os.getenv("JWT_CACHE_TTL_S", "300")),
+}
+
+class PublicKeyFetchConfig(TypedDict):
+    request_timeout_s: float
+    retries: int
+    backoff_base_ms: int
+    backoff_max_ms: int
+    discovery_ttl_s: int
+    prefetch_timeout_s: float
+
+# Fetching the auth public key: at startup (bounded by 'prefetch_timeout_s') and on rotation
+PUBLIC_KEY_FETCH_CONFIG: PublicKeyFetchConfig = {
+    "request_timeout_s": float(os.getenv("PUBLIC_KEY_REQUEST_TIMEOUT_S", "5")),
+    "retries": int(os.getenv("PUBLIC_KEY_RETRIES", "5")),
+    "backoff_base_ms": int(os.getenv("PUBLIC_KEY_BACKOFF_BASE_MS", "200")),
+    "backoff_max_ms": int(os.getenv("PUBLIC_KEY_BACKOFF_MAX_MS", "10000")),
+    "discovery_ttl_s": int(os.getenv("PUBLIC_KEY_DISCOVERY_TTL_S", "60")),
+    "prefetch_timeout_s": float(os.getenv("PUBLIC_KEY_PREFETCH_TIMEOUT_S", "5")),
+}
+
+class IdempotencyConfig(TypedDict):
+    cache_max_entries: int
+    ttl_s: int
+    prune_interval_s: int
+
+# Idempotency keys of handled messages: the most recent in memory, all of them in
+# w_processed_message until they are older than 'ttl_s'. Only messages with a
+# message_id have a key.
+IDEMPOTENCY_CONFIG: IdempotencyConfig = {
+    "cache_max_entries": int(os.getenv("IDEMPOTENCY_CACHE_MAX_ENTRIES", "10000")),
+    "ttl_s": int(os.getenv("IDEMPOTENCY_TTL_S", str(24 * 60 * 60))),
+    "prune_interval_s": int(os.getenv("IDEMPOTENCY_PRUNE_INTERVAL_S", "600")),
+}
+
+class PieceArchiveConfig(TypedDict):
+    enabled: bool
+    interval_s: int
+    batch_size: int
+    max_batches: int
+    min_age_s: int
+    vacuum_interval_s: int
+    vacuum_pages: int
+
+# Background move of terminal pieces to w_piece_archive. Completed orders are kept
+# 'min_age_s' first, so a late cancellation can still return their pieces to stock.
+PIECE_ARCHIVE_CONFIG: PieceArchiveConfig = {
+    "enabled": bool(int(os.getenv("PIECE_ARCHIVE_ENABLED", "1"))),
+    "interval_s": int(os.getenv("PIECE_ARCHIVE_INTERVAL_S", "300")),
+    "batch_size": int(os.getenv("PIECE_ARCHIVE_BATCH_SIZE", "500")),
+    "max_batches": int(os.getenv("PIECE_ARCHIVE_MAX_BATCHES", "20")),
+    "min_age_s": int(os.getenv("PIECE_ARCHIVE_MIN_AGE_S", str(24 * 60 * 60))),
+    "vacuum_interval_s": int(os.getenv("PIECE_ARCHIVE_VACUUM_INTERVAL_S", "3600")),
+    # Free pages given back to the filesystem per 'PRAGMA incremental_vacuum', 0 = all
+    "vacuum_pages": int(os.getenv("PIECE_ARCHIVE_VACUUM_PAGES", "1000")),
+}
+
+class WarehouseShardConfig(TypedDict):
+    capacities: Dict[int, int]
+    placement: Literal["hash", "least-loaded"]
+    stripes: int
+
+def _warehouse_capacities(spec: str) -> Dict[int, int]:
+    # "id:capacity,id:capacity,..."
+    capacities: Dict[int, int] = {}
+    for shard in filter(None, (part.strip() for part in spec.split(","))):
+        warehouse_id, capacity = shard.split(":")
+        capacities[int(warehouse_id)] = int(capacity)
+    return capacities
+
+# Capacity shards. Without WAREHOUSE_SHARDS there is a single warehouse 1 of WAREHOUSE_CAPACITY.
+# "hash": orders start at a shard chosen by order_id hash, "least-loaded": at the emptiest one.
+# Either way a reservation falls back to the other shards when the first one is full.
+WAREHOUSE_SHARD_CONFIG: WarehouseShardConfig = {
+    "capacities": _warehouse_capacities(
+        os.getenv("WAREHOUSE_SHARDS", f"1:{os.getenv('WAREHOUSE_CAPACITY', '1000')}")
+    ),
+    "placement": "least-loaded" if os.getenv("WAREHOUSE_PLACEMENT", "hash") == "least-loaded" else "hash",
+    # Counter rows each warehouse's reservations are spread over
+    "stripes": max(1, int(os.getenv("WAREHOUSE_CAPACITY_STRIPES", "1"))),
+}
+
+class StartupConfig(TypedDict):
+    retry_base_ms: int
+    retry_max_ms: int
+
+# Backoff of the background startup phases (broker logging, listeners, Consul...),
+# retried until they succeed or the service shuts down
+STARTUP_CONFIG: StartupConfig = {
+    "retry_base_ms": int(os.getenv("STARTUP_RETRY_BASE_MS", "500")),
+    "retry_max_ms": int(os.getenv("STARTUP_RETRY_MAX_MS", "30000")),
+}
+
+class WorkerConfig(TypedDict):
+    role: Literal["all", "http", "consumer"]
+    index: int
+    supervised: bool
+    http_processes: int
+    consumer_processes: int
+    consumer_prefetch_count: int
+    drain_timeout_s: float
+    metrics_port: int
+
+# "all": one process serves HTTP and consumes the queues. With more than one HTTP process
+# or any consumer process, `start_server` runs a supervisor that initializes the database
+# and Consul once and starts the processes of each role ('index' and 'supervised' are set
+# by the supervisor for its children). Metrics are kept per process: with 'metrics_port'
+# set, each supervised process serves its own on 'metrics_port' + its slot (the HTTP
+# processes first, then the consumers).
+WORKER_CONFIG: WorkerConfig = {
+    "role": role if (role := os.getenv("WAREHOUSE_ROLE", "all")) in ("http", "consumer") else "all",
+    "index": int(os.getenv("WAREHOUSE_PROCESS_INDEX", "0")),
+    "supervised": bool(int(os.getenv("WAREHOUSE_SUPERVISED", "0"))),
+    "http_processes": max(1, int(os.getenv("WAREHOUSE_HTTP_PROCESSES", os.getenv("WORKERS", "1")))),
+    "consumer_processes": max(0, int(os.getenv("WAREHOUSE_CONSUMER_PROCESSES", "0"))),
+    # Default: RABBITMQ_PREFETCH_COUNT shared out between the consumer processes
+    "consumer_prefetch_count": int(os.getenv("WAREHOUSE_CONSUMER_PREFETCH_COUNT", "0")),
+    "drain_timeout_s": float(os.getenv("WAREHOUSE_DRAIN_TIMEOUT_S", "30")),
+    "metrics_port": int(os.getenv("WAREHOUSE_METRICS_PORT", "0")),
+}
+
+class MachineEventBatchConfig(TypedDict):
+    enabled: bool
+    max_messages: int
+    max_wait_ms: int
+
+# Opt-in micro-batching of the machine 'producing'/'produced' event queues
+MACHINE_EVENT_BATCH_CONFIG: MachineEventBatchConfig = {
+    "enabled": bool(int(os.getenv("MACHINE_EVENT_BATCHING", "0"))),
+    "max_messages": int(os.getenv("MACHINE_EVENT_BATCH_SIZE", "100")),
+    "max_wait_ms": int(os.getenv("MACHINE_EVENT_BATCH_WAIT_MS", "50")),
+}
+
+class LogPipelineConfig(TypedDict):
+    queue_size: int
+    rate_limit_per_s: float
+    rate_limit_burst: int
+
+# Records of the handlers wrapped in warehouse.log_pipeline.AsyncHandler (see logging.ini) wait
+# in a bounded queue for a background thread, one per pipeline (console, broker); below WARNING,
+# each logging call site is limited to rate_limit_per_s records per second (0: no limit)
+LOG_PIPELINE_CONFIG: LogPipelineConfig = {
+    "queue_size": int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+    "rate_limit_per_s": float(os.getenv("LOG_RATE_LIMIT_PER_S", "50")),
+    "rate_limit_burst": int(os.getenv("LOG_RATE_LIMIT_BURST", "200")),
+}
+
 LISTENING_QUEUES: Dict[LiteralString, str] = {
     "piece_request": "order.piece.request",
     "piece_producing": "machine.piece.producing",
@@ -26,6 +269,8 @@ LISTENING_QUEUES: Dict[LiteralString, str] = {
     "saga_reserve": "warehouse.reserve",
     "saga_release": "warehouse.release",
     "saga_cancel": "warehouse.cancel",
-    "public_key": f"client.public_key.warehouse.{socket.gethostname()}",
+    # One queue per HTTP process of the host, as all of them need the key
+    "public_key": f"client.public_key.warehouse.{socket.gethostname()}"
+        + (f".{WORKER_CONFIG['role']}-{WORKER_CONFIG['index']}" if WORKER_CONFIG["supervised"] else ""),
 }
 PUBLIC_KEY: Dict[str, Optional[str]] = {"key": None}
@@ -0,0 +1,122 @@
+from .global_vars import (
+    HEALTH_PROBE_CONFIG,
+    HealthProbeConfig,
+    RABBITMQ_CONFIG,
+)
+from chassis.messaging import (
+    is_rabbitmq_healthy,
+    RabbitMQConfig,
+)
+from chassis.routers import get_system_metrics
+from chassis.sql import Engine
+from dataclasses import dataclass
+from sqlalchemy import text
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Optional,
+)
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class HealthSnapshot:
+    rabbitmq: bool
+    database: bool
+    system_metrics: dict[str, Any]
+    probed_at: float
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.probed_at
+
+
+class HealthProber:
+    """
+    Probes RabbitMQ, the database and the system metrics in the background.
+
+    The health endpoints only read `snapshot`, so a health check never opens a
+    broker connection or waits for the network. The broker probe and the metrics
+    run in a worker thread, and every probe is bounded by `timeout_ms`. A probe
+    that outlives its timeout is left running, and waited for again, instead of
+    starting another one: a hung probe holds one worker thread, not one per round.
+    """
+
+    def __init__(self, rabbitmq_config: RabbitMQConfig, config: HealthProbeConfig) -> None:
+        self._rabbitmq_config = rabbitmq_config
+        self._interval = config["interval_ms"] / 1000
+        self._timeout = config["timeout_ms"] / 1000
+        self.max_age = config["max_age_ms"] / 1000
+        self.snapshot: Optional[HealthSnapshot] = None
+        self._task: Optional[asyncio.Task] = None
+        # Probe name -> its running probe
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+    async def _probe_rabbitmq(self) -> bool:
+        return await asyncio.to_thread(is_rabbitmq_healthy, self._rabbitmq_config)
+
+    @staticmethod
+    async def _probe_database() -> bool:
+        async with Engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        return True
+
+    async def _bounded(self, name: str, probe: Callable[[], Awaitable[Any]], default: Any) -> Any:
+        if (future := self._in_flight.get(name)) is None or future.done():
+            future = self._in_flight[name] = asyncio.ensure_future(probe())
+            # Retrieved here too, in case nobody waits for it any more when it fails
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        else:
+            logger.warning("[LOG:HEALTH] - %s probe still running, waiting for it again", name)
+        try:
+            # Shielded: the probe keeps running past the timeout, for the next round
+            return await asyncio.wait_for(asyncio.shield(future), self._timeout)
+        except Exception as e:
+            logger.warning("[LOG:HEALTH] - %s probe failed: %s", name, e)
+            return default
+
+    async def refresh(self) -> HealthSnapshot:
+        rabbitmq, database, system_metrics = await asyncio.gather(
+            self._bounded("RabbitMQ", self._probe_rabbitmq, False),
+            self._bounded("Database", self._probe_database, False),
+            self._bounded("System metrics", lambda: asyncio.to_thread(get_system_metrics), {}),
+        )
+        self.snapshot = HealthSnapshot(
+            rabbitmq=rabbitmq,
+            database=database,
+            system_metrics=system_metrics,
+            probed_at=time.monotonic(),
+        )
+        return self.snapshot
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error("[LOG:HEALTH] - Health probe crashed: %s", e, exc_info=True)
+            await asyncio.sleep(self._interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # A probe stuck in a worker thread cannot be interrupted, only given up on
+        for future in self._in_flight.values():
+            future.cancel()
+        self._in_flight.clear()
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+HEALTH_PROBER = HealthProber(RABBITMQ_CONFIG, HEALTH_PROBE_CONFIG)
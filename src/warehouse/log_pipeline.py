@@ -0,0 +1,190 @@
+from .global_vars import (
+    LOG_PIPELINE_CONFIG,
+    LogPipelineConfig,
+)
+from .metrics import LOG_RECORDS_DROPPED
+from threading import (
+    Lock,
+    Thread,
+)
+from typing import (
+    Any,
+    Callable,
+    Optional,
+)
+import atexit
+import copy
+import logging
+import queue
+import time
+
+_STOP = None
+
+class LogPipeline:
+    """
+    A bounded queue and a background thread behind AsyncHandlers.
+
+    The caller only enqueues the record; the wrapped handler formats and writes it
+    (console, RabbitMQ...) from the pipeline thread. When the queue is full the
+    record is dropped and counted instead of blocking the caller. Each destination
+    gets its own pipeline (see `LOG_PIPELINES`), so a slow broker cannot hold back
+    the console.
+    """
+
+    def __init__(self, name: str, config: LogPipelineConfig) -> None:
+        self.name = name
+        self._queue: queue.Queue[Optional[tuple[logging.Handler, logging.LogRecord]]] = queue.Queue(
+            maxsize=max(1, config["queue_size"])
+        )
+        self._lock = Lock()
+        self._thread: Optional[Thread] = None
+        atexit.register(self.stop)
+
+    def put(self, handler: logging.Handler, record: logging.LogRecord) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        try:
+            self._queue.put_nowait((handler, record))
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(self.name, "queue_full")
+
+    def _run(self) -> None:
+        while (item := self._queue.get()) is not _STOP:
+            handler, record = item
+            try:
+                handler.handle(record)
+            except Exception:
+                handler.handleError(record)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = Thread(target=self._run, name=f"log-pipeline-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Write the queued records, for up to `timeout` seconds each to make room for
+        the stop marker and to join, and stop the thread. A thread that could not be
+        stopped in time is left running.
+        """
+        with self._lock:
+            if (thread := self._thread) is None:
+                return
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                return
+            thread.join(timeout)
+            if not thread.is_alive():
+                self._thread = None
+
+    @staticmethod
+    def _attached_handlers() -> set[tuple[logging.Logger, logging.Handler]]:
+        loggers = [logging.getLogger()] + [
+            logger for logger in logging.Logger.manager.loggerDict.values()
+            if isinstance(logger, logging.Logger)
+        ]
+        return {(logger, handler) for logger in loggers for handler in logger.handlers}
+
+    def adopt(self, install: Callable[[], Any]) -> int:
+        """
+        Run `install` (e.g. `setup_rabbitmq_logging`) and put the handlers it attached
+        behind this pipeline, on the same loggers; returns how many were wrapped. The
+        handlers that were there before, third-party ones included, are left alone.
+        """
+        attached_before = self._attached_handlers()
+        install()
+        adopted = 0
+        for logger, handler in self._attached_handlers() - attached_before:
+            if isinstance(handler, AsyncHandler):
+                continue
+            logger.removeHandler(handler)
+            logger.addHandler(AsyncHandler(handler, pipeline=self))
+            adopted += 1
+        return adopted
+
+
+LOG_PIPELINES: dict[str, LogPipeline] = {
+    name: LogPipeline(name, LOG_PIPELINE_CONFIG)
+    for name in ("console", "broker")
+}
+
+
+class AsyncHandler(logging.Handler):
+    """
+    Hands records to `pipeline` (a `LogPipeline` or a key of `LOG_PIPELINES`) for
+    `target`, a handler or the name of one listed before this one in the
+    logging.ini handler keys.
+
+    The caller only copies the record and renders its traceback, which is gone once
+    the exception is handled; `target` formats the message and writes it in the
+    pipeline thread. Below WARNING, each logging call site gets `rate_limit_per_s`
+    records per second, with bursts of up to `burst`; the rest are dropped and
+    counted.
+    """
+
+    def __init__(
+        self,
+        target: logging.Handler | str,
+        rate_limit_per_s: Optional[float] = None,
+        burst: Optional[int] = None,
+        pipeline: LogPipeline | str = "console",
+    ) -> None:
+        super().__init__()
+        if isinstance(pipeline, str):
+            if (named_pipeline := LOG_PIPELINES.get(pipeline)) is None:
+                raise ValueError(f"No log pipeline named '{pipeline}', expected one of {list(LOG_PIPELINES)}")
+            pipeline = named_pipeline
+        self._pipeline = pipeline
+        if isinstance(target, str):
+            # Holds the handler: logging only keeps weak references to named handlers
+            if (handler := logging.getHandlerByName(target)) is None:
+                raise ValueError(f"No handler named '{target}' is configured before this one")
+            target = handler
+        self._target = target
+        self._rate = LOG_PIPELINE_CONFIG["rate_limit_per_s"] if rate_limit_per_s is None else rate_limit_per_s
+        self._burst = float(max(1, LOG_PIPELINE_CONFIG["rate_limit_burst"] if burst is None else burst))
+        # Call site -> (tokens, last refill)
+        self._buckets: dict[tuple[str, int], tuple[float, float]] = {}
+        self._buckets_lock = Lock()
+
+    def _allow(self, record: logging.LogRecord) -> bool:
+        if self._rate <= 0 or record.levelno >= logging.WARNING:
+            return True
+        call_site = (record.pathname, record.lineno)
+        with self._buckets_lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(call_site, (self._burst, now))
+            tokens = min(self._burst, tokens + (now - last) * self._rate)
+            if tokens < 1:
+                self._buckets[call_site] = (tokens, now)
+                return False
+            self._buckets[call_site] = (tokens - 1, now)
+            return True
+
+    def _prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not record.exc_info:
+            return record
+        # On a copy: the other handlers of the logger still get the original record.
+        # `Formatter.format` uses exc_text as is when exc_info is gone.
+        record = copy.copy(record)
+        if not record.exc_text:
+            formatter = self._target.formatter or logging.Formatter()
+            record.exc_text = formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.levelno < self._target.level:
+            return
+        if not self._allow(record):
+            LOG_RECORDS_DROPPED.inc(self._pipeline.name, "rate_limited")
+            return
+        self._pipeline.put(self._target, self._prepare(record))
+
+    def close(self) -> None:
+        # fileConfig closes the handlers it replaces: write what they queued first
+        self._pipeline.stop()
+        super().close()
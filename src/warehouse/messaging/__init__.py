@@ -1,5 +1,23 @@
 from . import events
+from .async_consumer import (
+    AsyncQueueConsumer,
+    current_consumer,
+)
+from .batching import BatchingConsumer
+from .outbox_relay import OutboxRelay
+from .registry import (
+    BATCH_HANDLERS,
+    QUEUE_BINDINGS,
+    QueueBinding,
+)
 
 __all__: list[str] = [
-    "events"
+    "AsyncQueueConsumer",
+    "BATCH_HANDLERS",
+    "BatchingConsumer",
+    "current_consumer",
+    "events",
+    "OutboxRelay",
+    "QUEUE_BINDINGS",
+    "QueueBinding",
 ]
\ No newline at end of file
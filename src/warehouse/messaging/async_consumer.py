@@ -0,0 +1,255 @@
+from ..global_vars import AsyncConsumerConfig
+from ..metrics import (
+    PUBLISH_DURATION,
+    PUBLISH_FAILURES,
+)
+from .connection import connection_kwargs
+from .registry import QueueBinding
+from aio_pika.abc import (
+    AbstractChannel,
+    AbstractExchange,
+    AbstractIncomingMessage,
+    AbstractQueue,
+    AbstractRobustConnection,
+)
+from aio_pika.exceptions import ChannelClosed
+from chassis.messaging import (
+    MessageType,
+    RabbitMQConfig,
+)
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Optional,
+)
+import aio_pika
+import asyncio
+import inspect
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Times a message was published again after its handler failed
+RETRY_HEADER = "x-warehouse-retries"
+
+# The consumer running the current message handler, if any
+_CURRENT_CONSUMER: ContextVar[Optional["AsyncQueueConsumer"]] = ContextVar("current_consumer", default=None)
+
+def current_consumer() -> Optional["AsyncQueueConsumer"]:
+    """The asyncio consumer serving the message being handled, None in the other modes."""
+    return _CURRENT_CONSUMER.get()
+
+
+class AsyncQueueConsumer:
+    """
+    Serves the listening queues from the application event loop with aio-pika.
+
+    Every queue gets its own channel with `prefetch_count` as QoS, so at most that
+    many messages per queue are in flight. Coroutine handlers run on the loop;
+    synchronous ones are pushed to a worker thread. Handlers reply through `publish`,
+    on the same connection, instead of a blocking pika publish. A message whose
+    handler fails goes back to the end of its queue up to `max_retries` times, and
+    is rejected after that. `stop()` cancels the consumers first and then waits for
+    the in-flight messages before closing the connection.
+    """
+
+    def __init__(
+        self,
+        rabbitmq_config: RabbitMQConfig,
+        bindings: list[QueueBinding],
+        config: AsyncConsumerConfig,
+    ) -> None:
+        self._rabbitmq_config = rabbitmq_config
+        self._bindings = bindings
+        self._max_retries = config["max_retries"]
+        self._prefetch_count = max(1, rabbitmq_config["prefetch_count"])
+        self._connection: Optional[AbstractRobustConnection] = None
+        self._consumers: list[tuple[AbstractQueue, str]] = []
+        self._in_flight: set[asyncio.Task] = set()
+        self._publish_lock = asyncio.Lock()
+        self._publish_channel: Optional[AbstractChannel] = None
+        self._exchanges: dict[str, AbstractExchange] = {}
+
+    async def _channel(self) -> AbstractChannel:
+        assert self._connection is not None, "Consumer should be connected"
+        channel = await self._connection.channel()
+        await channel.set_qos(prefetch_count=self._prefetch_count)
+        return channel
+
+    async def _declare(self, binding: QueueBinding) -> AbstractQueue:
+        # Passive declarations first, so existing queues/exchanges are reused as they are
+        channel = await self._channel()
+        try:
+            queue = await channel.declare_queue(binding.queue, passive=True)
+        except ChannelClosed:
+            channel = await self._channel()
+            queue = await channel.declare_queue(binding.queue, durable=True)
+
+        if binding.exchange is not None:
+            try:
+                await channel.declare_exchange(binding.exchange, passive=True)
+            except ChannelClosed:
+                channel = await self._channel()
+                await channel.declare_exchange(
+                    binding.exchange,
+                    type=binding.exchange_type or "direct",
+                    durable=True,
+                )
+                queue = await channel.declare_queue(binding.queue, passive=True)
+            await queue.bind(binding.exchange, routing_key=binding.routing_key or binding.queue)
+        return queue
+
+    async def _exchange(self, name: str, exchange_type: str) -> AbstractExchange:
+        # Passive declaration first, so an existing exchange is reused as it is
+        async with self._publish_lock:
+            if (exchange := self._exchanges.get(name)) is not None:
+                return exchange
+            assert self._connection is not None, "Consumer should be connected"
+            if self._publish_channel is None or self._publish_channel.is_closed:
+                self._publish_channel = await self._connection.channel()
+            if not name:
+                return self._publish_channel.default_exchange
+            try:
+                exchange = await self._publish_channel.declare_exchange(name, passive=True)
+            except ChannelClosed:
+                self._publish_channel = await self._connection.channel()
+                exchange = await self._publish_channel.declare_exchange(name, type=exchange_type, durable=True)
+            self._exchanges[name] = exchange
+            return exchange
+
+    async def publish(
+        self,
+        message: MessageType,
+        exchange: str,
+        exchange_type: str,
+        routing_key: str,
+        *,
+        call_site: str = "unknown",
+    ) -> None:
+        started = time.perf_counter()
+        for attempt in range(2):
+            try:
+                target = await self._exchange(exchange, exchange_type)
+                await target.publish(
+                    aio_pika.Message(
+                        body=json.dumps(message).encode(),
+                        content_type="application/json",
+                        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    ),
+                    routing_key=routing_key,
+                )
+                PUBLISH_DURATION.observe(time.perf_counter() - started, call_site)
+                return
+            except Exception as e:
+                self._exchanges.pop(exchange, None)
+                if attempt == 1:
+                    PUBLISH_FAILURES.inc(call_site)
+                    raise
+                logger.warning(
+                    "[LOG:ASYNC_CONSUMER] - Publish failed, declaring again: exchange=%s, reason=%s",
+                    exchange,
+                    e,
+                )
+
+    async def _process(self, binding: QueueBinding, message: AbstractIncomingMessage) -> None:
+        _CURRENT_CONSUMER.set(self)
+        try:
+            body: Any = json.loads(message.body)
+            if inspect.iscoroutinefunction(binding.handler):
+                await binding.handler(body)
+            else:
+                await asyncio.to_thread(binding.handler, body)
+            await message.ack()
+        except Exception as e:
+            logger.error(
+                "[LOG:ASYNC_CONSUMER] - Could not process message on '%s': %s",
+                binding.queue,
+                e,
+                exc_info=True,
+            )
+            await self._retry(binding, message)
+
+    async def _retry(self, binding: QueueBinding, message: AbstractIncomingMessage) -> None:
+        # A plain requeue carries no count, so the message goes back with one in a header
+        retries = int((message.headers or {}).get(RETRY_HEADER, 0))
+        if retries >= self._max_retries:
+            logger.error(
+                "[LOG:ASYNC_CONSUMER] - Giving up on message on '%s' after %d retries, rejecting it",
+                binding.queue,
+                retries,
+            )
+            await message.nack(requeue=False)
+            return
+
+        try:
+            default_exchange = await self._exchange("", "direct")
+            await default_exchange.publish(
+                aio_pika.Message(
+                    body=message.body,
+                    content_type=message.content_type,
+                    message_id=message.message_id,
+                    headers={**(message.headers or {}), RETRY_HEADER: retries + 1},
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                ),
+                routing_key=binding.queue,
+            )
+        except Exception as e:
+            logger.warning(
+                "[LOG:ASYNC_CONSUMER] - Could not publish the retry on '%s', requeueing: %s",
+                binding.queue,
+                e,
+            )
+            await message.nack(requeue=True)
+            return
+        await message.ack()
+        logger.warning(
+            "[LOG:ASYNC_CONSUMER] - Message on '%s' queued again: retry %d of %d",
+            binding.queue,
+            retries + 1,
+            self._max_retries,
+        )
+
+    def _on_message(self, binding: QueueBinding):
+        async def callback(message: AbstractIncomingMessage) -> None:
+            task = asyncio.create_task(self._process(binding, message))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+        return callback
+
+    async def start(self) -> None:
+        self._connection = await aio_pika.connect_robust(**connection_kwargs(self._rabbitmq_config))
+        for binding in self._bindings:
+            queue = await self._declare(binding)
+            consumer_tag = await queue.consume(self._on_message(binding))
+            self._consumers.append((queue, consumer_tag))
+            logger.info("[LOG:ASYNC_CONSUMER] - Consuming '%s'", binding.queue)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        for queue, consumer_tag in self._consumers:
+            try:
+                await queue.cancel(consumer_tag)
+            except Exception as e:
+                logger.warning("[LOG:ASYNC_CONSUMER] - Could not cancel consumer of '%s': %s", queue.name, e)
+        self._consumers.clear()
+
+        if self._in_flight:
+            logger.info("[LOG:ASYNC_CONSUMER] - Draining %d in-flight messages", len(self._in_flight))
+            _, pending = await asyncio.wait(set(self._in_flight), timeout=timeout)
+            if pending:
+                logger.warning(
+                    "[LOG:ASYNC_CONSUMER] - %d messages still running after %ss, they will be redelivered",
+                    len(pending),
+                    timeout,
+                )
+                for task in pending:
+                    task.cancel()
+                # Their acks must not race the connection close
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+        self._publish_channel = None
+        self._exchanges.clear()
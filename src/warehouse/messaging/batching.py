@@ -0,0 +1,173 @@
+from .connection import connection_parameters
+from .registry import (
+    BatchHandler,
+    QueueBinding,
+)
+from chassis.messaging import (
+    MessageType,
+    RabbitMQConfig,
+)
+from pika.adapters.blocking_connection import BlockingChannel
+from pika.exceptions import (
+    AMQPChannelError,
+    AMQPConnectionError,
+)
+import asyncio
+import inspect
+import json
+import logging
+import pika
+import time
+
+logger = logging.getLogger(__name__)
+
+class BatchingConsumer:
+    """
+    Consumes a queue in micro-batches instead of one message at a time.
+
+    Messages are collected until `max_messages` are pending or `max_wait_ms` have
+    passed since the first one arrived. The batch handler then applies all of them
+    and the whole batch is acknowledged with a single multiple-ack. If the batch
+    handler fails, every message is retried alone through the regular handler, so a
+    single bad message cannot block the others.
+    """
+
+    RECONNECT_DELAY = 5.0
+
+    def __init__(
+        self,
+        binding: QueueBinding,
+        batch_handler: BatchHandler,
+        rabbitmq_config: RabbitMQConfig,
+        max_messages: int,
+        max_wait_ms: int,
+    ) -> None:
+        self._binding = binding
+        self._batch_handler = batch_handler
+        self._rabbitmq_config = rabbitmq_config
+        self._max_messages = max(1, max_messages)
+        self._max_wait = max_wait_ms / 1000
+        self._loop = asyncio.new_event_loop()
+
+    @staticmethod
+    def _declare(connection: pika.BlockingConnection, binding: QueueBinding) -> BlockingChannel:
+        # Passive declarations first, so existing queues/exchanges are reused as they are
+        channel = connection.channel()
+        try:
+            channel.queue_declare(binding.queue, passive=True)
+        except AMQPChannelError:
+            channel = connection.channel()
+            channel.queue_declare(binding.queue, durable=True)
+
+        if binding.exchange is not None:
+            try:
+                channel.exchange_declare(binding.exchange, passive=True)
+            except AMQPChannelError:
+                channel = connection.channel()
+                channel.exchange_declare(
+                    binding.exchange,
+                    exchange_type=binding.exchange_type or "direct",
+                    durable=True,
+                )
+            channel.queue_bind(
+                binding.queue,
+                binding.exchange,
+                routing_key=binding.routing_key or binding.queue,
+            )
+        return channel
+
+    def _handle_single(self, message: MessageType) -> None:
+        result = self._binding.handler(message)
+        if inspect.isawaitable(result):
+            self._loop.run_until_complete(result)
+
+    def _flush(self, channel: BlockingChannel, batch: list[tuple[int, MessageType]]) -> None:
+        messages = [message for _, message in batch]
+        try:
+            self._loop.run_until_complete(self._batch_handler(messages))
+            channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+            return
+        except Exception as e:
+            logger.warning(
+                "[LOG:BATCHING_CONSUMER] - Batch of %d failed on '%s', retrying one by one: %s",
+                len(batch),
+                self._binding.queue,
+                e,
+            )
+
+        for delivery_tag, message in batch:
+            try:
+                self._handle_single(message)
+                channel.basic_ack(delivery_tag=delivery_tag)
+            except Exception as e:
+                logger.error(
+                    "[LOG:BATCHING_CONSUMER] - Could not process message on '%s': message=%s, reason=%s",
+                    self._binding.queue,
+                    message,
+                    e,
+                    exc_info=True,
+                )
+                channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+
+    def _consume(self) -> None:
+        connection = pika.BlockingConnection(connection_parameters(self._rabbitmq_config))
+        try:
+            channel = self._declare(connection, self._binding)
+            channel.basic_qos(
+                prefetch_count=max(self._max_messages, self._rabbitmq_config["prefetch_count"])
+            )
+
+            batch: list[tuple[int, MessageType]] = []
+            deadline = 0.0
+            for method, _, body in channel.consume(
+                self._binding.queue,
+                inactivity_timeout=max(self._max_wait / 4, 0.001),
+            ):
+                if method is not None:
+                    try:
+                        message = json.loads(body)
+                    except ValueError:
+                        logger.error(
+                            "[LOG:BATCHING_CONSUMER] - Dropping undecodable message on '%s': body=%r",
+                            self._binding.queue,
+                            body,
+                        )
+                        channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                        continue
+                    if not batch:
+                        deadline = time.monotonic() + self._max_wait
+                    batch.append((method.delivery_tag, message))
+
+                if batch and (len(batch) >= self._max_messages or time.monotonic() >= deadline):
+                    self._flush(channel, batch)
+                    batch = []
+        finally:
+            if connection.is_open:
+                connection.close()
+
+    def run(self) -> None:
+        logger.info(
+            "[LOG:BATCHING_CONSUMER] - Consuming '%s' in batches of up to %d messages / %.0fms",
+            self._binding.queue,
+            self._max_messages,
+            self._max_wait * 1000,
+        )
+        while True:
+            try:
+                self._consume()
+            except AMQPConnectionError as e:
+                logger.warning(
+                    "[LOG:BATCHING_CONSUMER] - Connection lost on '%s', reconnecting in %ss: %s",
+                    self._binding.queue,
+                    self.RECONNECT_DELAY,
+                    e,
+                )
+            except Exception as e:
+                logger.error(
+                    "[LOG:BATCHING_CONSUMER] - Consumer of '%s' crashed, restarting in %ss: %s",
+                    self._binding.queue,
+                    self.RECONNECT_DELAY,
+                    e,
+                    exc_info=True,
+                )
+            time.sleep(self.RECONNECT_DELAY)
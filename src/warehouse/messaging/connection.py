@@ -0,0 +1,45 @@
+from chassis.messaging import RabbitMQConfig
+from typing import (
+    Any,
+    Optional,
+)
+import pika
+import ssl
+
+def ssl_context(rabbitmq_config: RabbitMQConfig) -> Optional[ssl.SSLContext]:
+    if not rabbitmq_config["use_tls"]:
+        return None
+
+    context = ssl.create_default_context(
+        cafile=str(rabbitmq_config["ca_cert"]) if rabbitmq_config["ca_cert"] else None,
+    )
+    if rabbitmq_config["client_cert"] and rabbitmq_config["client_key"]:
+        context.load_cert_chain(
+            certfile=str(rabbitmq_config["client_cert"]),
+            keyfile=str(rabbitmq_config["client_key"]),
+        )
+    return context
+
+def connection_parameters(rabbitmq_config: RabbitMQConfig) -> pika.ConnectionParameters:
+    """Build pika connection parameters from the service RabbitMQ configuration."""
+    context = ssl_context(rabbitmq_config)
+    return pika.ConnectionParameters(
+        host=rabbitmq_config["host"],
+        port=rabbitmq_config["port"],
+        credentials=pika.PlainCredentials(
+            rabbitmq_config["username"],
+            rabbitmq_config["password"],
+        ),
+        ssl_options=pika.SSLOptions(context, rabbitmq_config["host"]) if context else None,
+    )
+
+def connection_kwargs(rabbitmq_config: RabbitMQConfig) -> dict[str, Any]:
+    """Build `aio_pika.connect`/`connect_robust` arguments from the service RabbitMQ configuration."""
+    return {
+        "host": rabbitmq_config["host"],
+        "port": rabbitmq_config["port"],
+        "login": rabbitmq_config["username"],
+        "password": rabbitmq_config["password"],
+        "ssl": rabbitmq_config["use_tls"],
+        "ssl_context": ssl_context(rabbitmq_config),
+    }
@@ -1,23 +1,31 @@
-from ..business_logic import WarehouseManager
-from ..global_vars import (
-    LISTENING_QUEUES,
-    PUBLIC_KEY,
-    RABBITMQ_CONFIG,
+from ..business_logic import (
+    DuplicateMessage,
+    PUBLISHER_POOL,
+    WarehouseManager,
 )
+from ..global_vars import LISTENING_QUEUES
+from ..security import PUBLIC_KEY_FETCHER
 from ..sql import OrderPieceSchema
-from chassis.consul import CONSUL_CLIENT
-from chassis.messaging import (
-    MessageType,
-    RabbitMQPublisher,
+from .async_consumer import current_consumer
+from .idempotency import (
+    idempotent,
+    idempotent_batch,
+)
+from .registry import (
+    register_batch_handler,
     register_queue_handler,
 )
-from typing import cast
+from chassis.messaging import MessageType
+from typing import (
+    Any,
+    cast,
+)
 import logging
-import requests
 
 logger = logging.getLogger(__name__)
 
 @register_queue_handler(LISTENING_QUEUES["piece_request"])
+@idempotent("piece_request")
 async def piece_request(message: MessageType) -> None:
     assert (order_id := message.get("order_id")) is not None, "'order_id' should be present"
     assert (pieces := message.get("pieces")) is not None, "'pieces' should be present"
@@ -25,7 +33,7 @@ async def piece_request(message: MessageType) -> None:
     order_id = int(order_id)
     pieces = cast(list[OrderPieceSchema], list(pieces))
     
-    logger.info(f"[EVENT:WAREHOUSE:PIECES_REQUESTED] - order_id={order_id} pieces={pieces}")
+    logger.info("[EVENT:WAREHOUSE:PIECES_REQUESTED] - order_id=%s pieces=%s", order_id, pieces)
 
     await WarehouseManager.produce_pieces(
         order_id=order_id,
@@ -38,11 +46,19 @@ async def piece_request(message: MessageType) -> None:
     exchange_type="topic",
     routing_key="machine.piece.producing",
 )
+@idempotent("piece_producing")
 async def piece_producing(message: MessageType) -> None:
     assert (piece_id := message.get("piece_id")) is not None, "'piece_id' should exist"
     piece_id = int(piece_id)
     await WarehouseManager.piece_producing(piece_id)
-    logger.info(f"[EVENT:WAREHOUSE:PIECE_PRODUCING] - piece_id={piece_id}")
+    logger.info("[EVENT:WAREHOUSE:PIECE_PRODUCING] - piece_id=%s", piece_id)
+
+@register_batch_handler(LISTENING_QUEUES["piece_producing"])
+@idempotent_batch("piece_producing")
+async def piece_producing_batch(messages: list[MessageType]) -> None:
+    piece_ids = [int(message["piece_id"]) for message in messages]
+    await WarehouseManager.pieces_producing(piece_ids)
+    logger.info("[EVENT:WAREHOUSE:PIECES_PRODUCING] - piece_ids=%s", piece_ids)
 
 @register_queue_handler(
     queue=LISTENING_QUEUES["piece_produced"],
@@ -50,11 +66,37 @@ async def piece_producing(message: MessageType) -> None:
     exchange_type="topic",
     routing_key="machine.piece.produced",
 )
+@idempotent("piece_produced")
 async def piece_produced(message: MessageType) -> None:
     assert (piece_id := message.get("piece_id")) is not None, "'piece_id' should be present"
     piece_id = int(piece_id)
     await WarehouseManager.piece_produced(piece_id)
-    logger.info(f"[EVENT:WAREHOUSE:PIECE_PRODUCED] - piece_id={piece_id}")
+    logger.info("[EVENT:WAREHOUSE:PIECE_PRODUCED] - piece_id=%s", piece_id)
+
+@register_batch_handler(LISTENING_QUEUES["piece_produced"])
+@idempotent_batch("piece_produced")
+async def piece_produced_batch(messages: list[MessageType]) -> None:
+    piece_ids = [int(message["piece_id"]) for message in messages]
+    await WarehouseManager.pieces_produced(piece_ids)
+    logger.info("[EVENT:WAREHOUSE:PIECES_PRODUCED] - piece_ids=%s", piece_ids)
+
+async def _reply_reservation(message: MessageType, response: dict[str, Any]) -> None:
+    target = {
+        "exchange": str(message["response_exchange"]),
+        "exchange_type": str(message["response_exchange_type"]),
+        "routing_key": str(message["response_routing_key"]),
+    }
+    # On the asyncio consumer, a blocking pika publish would stall the event loop
+    if (consumer := current_consumer()) is not None:
+        await consumer.publish(response, **target, call_site="saga_reserve_reply")
+        return
+    PUBLISHER_POOL.publish(
+        response,
+        queue="",
+        auto_delete_queue=True,
+        call_site="saga_reserve_reply",
+        **target,
+    )
 
 @register_queue_handler(
     queue=LISTENING_QUEUES["saga_reserve"],
@@ -62,47 +104,44 @@ async def piece_produced(message: MessageType) -> None:
     exchange_type="topic",
     routing_key="warehouse.reserve",
 )
+# Only a committed reservation records the key: a duplicate gets the OK reply again,
+# the saga may have missed it
+@idempotent(
+    "saga_reserve",
+    on_duplicate=lambda message: _reply_reservation(message, {"status": "OK"}),
+)
 async def warehouse_reservation(message: MessageType) -> None:
     assert (order_id := message.get("order_id")) is not None, "'order_id' should exist"
-    assert (response_exchange := message.get("response_exchange")) is not None, "'response_exchange' should exist"
-    assert (response_exchange_type := message.get("response_exchange_type")) is not None, "'response_exchange_type' should exist"
-    assert (response_routing_key := message.get("response_routing_key")) is not None, "'response_routing_key' should exist"
+    assert message.get("response_exchange") is not None, "'response_exchange' should exist"
+    assert message.get("response_exchange_type") is not None, "'response_exchange_type' should exist"
+    assert message.get("response_routing_key") is not None, "'response_routing_key' should exist"
 
     order_id = int(order_id)
-    response_exchange = str(response_exchange)
-    response_exchange_type = str(response_exchange_type)
-    response_routing_key = str(response_routing_key)
     response = {}
 
     logger.info(
-        "[CMD:WAREHOUSE_RESERVE:RECEIVED] - Received reserve command: "
-        f"order_id={order_id}"
+        "[CMD:WAREHOUSE_RESERVE:RECEIVED] - Received reserve command: order_id=%s",
+        order_id,
     )
 
     try:
         await WarehouseManager.try_reserve_space(order_id)
         response["status"] = "OK"
         logger.info(
-            "[EVENT:WAREHOUSE_RESERVE:SUCCESS] - Warehouse space reserved: "
-            f"order_id={order_id}"
+            "[EVENT:WAREHOUSE_RESERVE:SUCCESS] - Warehouse space reserved: order_id=%s",
+            order_id,
         )
+    except DuplicateMessage:
+        raise
     except Exception as e:
         response["status"] = f"Error: {e}"
         logger.info(
-            "[EVENT:PAYMENT_RESERVE:FAILED] - Payment reserve failed: "
-            f"order_id={order_id}, "
-            f"status='{response["status"]}'"
+            "[EVENT:PAYMENT_RESERVE:FAILED] - Payment reserve failed: order_id=%s, status='%s'",
+            order_id,
+            response["status"],
         )
 
-    with RabbitMQPublisher(
-        queue="",
-        rabbitmq_config=RABBITMQ_CONFIG,
-        exchange=response_exchange,
-        exchange_type=response_exchange_type,
-        routing_key=response_routing_key,
-        auto_delete_queue=True,
-    ) as publisher:
-        publisher.publish(response)
+    await _reply_reservation(message, response)
 
 @register_queue_handler(
     queue=LISTENING_QUEUES["saga_release"],
@@ -110,14 +149,15 @@ async def warehouse_reservation(message: MessageType) -> None:
     exchange_type="topic",
     routing_key="warehouse.release",
 )
+@idempotent("saga_release")
 async def warehouse_release(message: MessageType) -> None:
     assert (order_id := message.get("order_id")) is not None, "'order_id' should exist"
 
     order_id = int(order_id)
 
     logger.info(
-        "[CMD:WAREHOUSE_RELEASE:RECEIVED] - Received release command: "
-        f"order_id={order_id}, "
+        "[CMD:WAREHOUSE_RELEASE:RECEIVED] - Received release command: order_id=%s",
+        order_id,
     )
 
     await WarehouseManager.release_space(order_id)
@@ -127,14 +167,15 @@ async def warehouse_release(message: MessageType) -> None:
     exchange="cancellation-approved",
     exchange_type="fanout",
 )
+@idempotent("saga_cancel")
 async def warehouse_cancel(message: MessageType) -> None:
     assert (order_id := message.get("order_id")) is not None, "'order_id' should exist"
 
     order_id = int(order_id)
 
     logger.info(
-        "[EVENT:WAREHOUSE_CANCEL:RECEIVED] - Received order cancel command: "
-        f"order_id={order_id}, "
+        "[EVENT:WAREHOUSE_CANCEL:RECEIVED] - Received order cancel command: order_id=%s",
+        order_id,
     )
     await WarehouseManager.cancel_order(order_id)
 
@@ -144,26 +185,10 @@ async def warehouse_cancel(message: MessageType) -> None:
     exchange_type="fanout"
 )
 def public_key(message: MessageType) -> None:
-    global PUBLIC_KEY
-    assert (auth_base_url := CONSUL_CLIENT.discover_service("auth")) is not None, (
-        "The 'auth' service should be accesible"
-    )
     assert "public_key" in message, "'public_key' field should be present."
     assert message["public_key"] == "AVAILABLE", (
         f"'public_key' value is '{message['public_key']}', expected 'AVAILABLE'"
     )
-    address, port = auth_base_url
-    response = requests.get(f"{address}:{port}/auth/key", timeout=5)
-    assert response.status_code == 200, (
-        f"Public key request returned '{response.status_code}', should return '200'"
-    )
-    data: dict = response.json()
-    new_key = data.get("public_key")
-    assert new_key is not None, (
-        "Auth response did not contain expected 'public_key' field."
-    )
-    PUBLIC_KEY["key"] = str(new_key)
-    logger.info(
-        "[EVENT:PUBLIC_KEY:UPDATED] - Public key updated: "
-        f"key={PUBLIC_KEY["key"]}"
-    )
\ No newline at end of file
+    # Fetched on the app event loop, so this consumer is free right away
+    PUBLIC_KEY_FETCHER.request_refresh()
+    logger.info("[EVENT:PUBLIC_KEY:AVAILABLE] - Public key refresh scheduled")
@@ -0,0 +1,113 @@
+from ..business_logic import (
+    DuplicateMessage,
+    PROCESSED_MESSAGES,
+)
+from chassis.messaging import MessageType
+from functools import wraps
+from typing import (
+    Awaitable,
+    Callable,
+    Optional,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[MessageType], Awaitable[None]]
+BatchHandler = Callable[[list[MessageType]], Awaitable[None]]
+
+def idempotency_key(command: str, message: MessageType) -> Optional[str]:
+    """
+    `command:message_id`, or None when the sender set no message_id: the same
+    payload may be a new command (e.g. reserve, release, reserve again), so it is
+    never taken for a duplicate.
+    """
+    if (message_id := message.get("message_id")) is None:
+        return None
+    return f"{command}:{message_id}"
+
+def idempotent(
+    command: str,
+    on_duplicate: Optional[MessageHandler] = None,
+) -> Callable[[MessageHandler], MessageHandler]:
+    """
+    Skip messages whose idempotency key was handled already.
+
+    The key is recorded by the `PROCESSED_MESSAGES.run` write of the handler, in
+    the transaction of its state change; a handler that fails, or changes nothing,
+    leaves it unrecorded so a redelivery is handled again. A duplicate is passed to
+    `on_duplicate` instead of the handler, e.g. to send the reply again.
+    """
+    def decorator(handler: MessageHandler) -> MessageHandler:
+        @wraps(handler)
+        async def wrapper(message: MessageType) -> None:
+            if (key := idempotency_key(command, message)) is None:
+                await handler(message)
+                return
+
+            if await PROCESSED_MESSAGES.lookup([key]):
+                logger.info("[LOG:IDEMPOTENCY] - Skipping duplicate message: key=%s", key)
+                if on_duplicate is not None:
+                    await on_duplicate(message)
+                return
+
+            try:
+                with PROCESSED_MESSAGES.handling([key]):
+                    await handler(message)
+            except DuplicateMessage:
+                logger.info("[LOG:IDEMPOTENCY] - Duplicate message handled concurrently: key=%s", key)
+
+        return wrapper
+
+    return decorator
+
+async def new_messages(
+    command: str,
+    messages: list[MessageType],
+) -> tuple[list[MessageType], list[str]]:
+    """
+    The messages of a batch that were not handled yet, without repetitions, and
+    the keys to apply them with in `PROCESSED_MESSAGES.handling(keys)`. Messages
+    without a key are always new.
+    """
+    keyed_messages: dict[str, MessageType] = {}
+    unkeyed_messages: list[MessageType] = []
+    for message in messages:
+        if (key := idempotency_key(command, message)) is None:
+            unkeyed_messages.append(message)
+        else:
+            keyed_messages.setdefault(key, message)
+
+    processed = await PROCESSED_MESSAGES.lookup(list(keyed_messages)) if keyed_messages else set()
+    new_keys = [key for key in keyed_messages if key not in processed]
+    if (duplicate_count := len(messages) - len(unkeyed_messages) - len(new_keys)) > 0:
+        logger.info("[LOG:IDEMPOTENCY] - Skipping %d duplicate messages of '%s'", duplicate_count, command)
+
+    return [keyed_messages[key] for key in new_keys] + unkeyed_messages, new_keys
+
+def idempotent_batch(command: str) -> Callable[[BatchHandler], BatchHandler]:
+    """
+    `idempotent` for batch handlers: the handler gets the messages of the batch
+    that were not handled yet, if any. When some of them are committed meanwhile
+    by another delivery, the batch is filtered again and the rest applied.
+    """
+    def decorator(handler: BatchHandler) -> BatchHandler:
+        @wraps(handler)
+        async def wrapper(messages: list[MessageType]) -> None:
+            while True:
+                new, keys = await new_messages(command, messages)
+                if not new:
+                    return
+                try:
+                    with PROCESSED_MESSAGES.handling(keys):
+                        await handler(new)
+                    return
+                except DuplicateMessage as e:
+                    logger.info(
+                        "[LOG:IDEMPOTENCY] - Duplicate messages handled concurrently: keys=%s",
+                        list(e.args),
+                    )
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,221 @@
+from ..business_logic import OUTBOX
+from ..global_vars import OutboxConfig
+from ..metrics import (
+    PUBLISH_DURATION,
+    PUBLISH_FAILURES,
+)
+from ..sql import (
+    delete_outbox_messages,
+    get_outbox_messages,
+    OutboxMessage,
+)
+from .connection import connection_kwargs
+from aio_pika.abc import (
+    AbstractChannel,
+    AbstractConnection,
+    AbstractExchange,
+)
+from aio_pika.exceptions import (
+    AMQPConnectionError,
+    ChannelClosed,
+)
+from chassis.messaging import RabbitMQConfig
+from chassis.sql import SessionLocal
+from typing import (
+    Any,
+    Optional,
+)
+import aio_pika
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class OutboxRelay:
+    """
+    Publishes the outbox to RabbitMQ from a task on the application event loop.
+
+    The relay keeps one connection open and its channel in publisher-confirm mode.
+    Messages are read in id order, `batch_size` at a time, and published back to
+    back; the broker confirmations of the whole batch are awaited together and the
+    confirmed messages are deleted with one statement, so every message is
+    published at least once and in the order it was committed. It wakes up when
+    `OUTBOX` is notified and polls every `poll_interval_ms` otherwise.
+    """
+
+    RECONNECT_DELAY = 5.0
+    TASK_NAME = "outbox-relay"
+
+    def __init__(self, rabbitmq_config: RabbitMQConfig, config: OutboxConfig) -> None:
+        self._rabbitmq_config = rabbitmq_config
+        self._batch_size = max(1, config["batch_size"])
+        self._poll_interval = config["poll_interval_ms"] / 1000
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._connection: Optional[AbstractConnection] = None
+        self._channel: Optional[AbstractChannel] = None
+        self._declared: set[tuple[str, str]] = set()
+
+    async def _open_channel(self) -> AbstractChannel:
+        assert self._connection is not None
+        self._channel = await self._connection.channel(publisher_confirms=True)
+        return self._channel
+
+    async def _connect(self) -> None:
+        self._connection = await aio_pika.connect(**connection_kwargs(self._rabbitmq_config))
+        self._declared = set()
+        await self._open_channel()
+
+    async def _disconnect(self) -> None:
+        connection, self._connection, self._channel = self._connection, None, None
+        if connection is not None and not connection.is_closed:
+            try:
+                await connection.close()
+            except Exception as e:
+                logger.debug("[LOG:OUTBOX_RELAY] - Error closing connection: %s", e)
+
+    async def _declare(self, queue: str, publisher_args: dict[str, Any]) -> None:
+        # Passive declarations first, so existing queues/exchanges are reused as they are
+        target = (queue, json.dumps(publisher_args, sort_keys=True))
+        if target in self._declared:
+            return
+
+        assert self._channel is not None
+        if (exchange := publisher_args.get("exchange")):
+            try:
+                await self._channel.declare_exchange(exchange, passive=True)
+            except ChannelClosed:
+                await (await self._open_channel()).declare_exchange(
+                    exchange,
+                    type=publisher_args.get("exchange_type", "direct"),
+                    durable=True,
+                )
+        elif queue:
+            try:
+                await self._channel.declare_queue(queue, passive=True)
+            except ChannelClosed:
+                await (await self._open_channel()).declare_queue(queue, durable=True)
+        self._declared.add(target)
+
+    async def _exchange(self, name: str) -> AbstractExchange:
+        assert self._channel is not None
+        if not name:
+            return self._channel.default_exchange
+        return await self._channel.get_exchange(name, ensure=False)
+
+    async def _publish(self, message: OutboxMessage) -> None:
+        exchange = await self._exchange(message.publisher_args.get("exchange", ""))
+        await exchange.publish(
+            aio_pika.Message(
+                body=json.dumps(message.payload).encode(),
+                content_type="application/json",
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=message.publisher_args.get("routing_key") or message.queue,
+        )
+
+    async def _timed_publish(self, message: OutboxMessage) -> float:
+        # Each publish is timed up to its own confirm, not to the end of the batch
+        started = time.perf_counter()
+        await self._publish(message)
+        return time.perf_counter() - started
+
+    @staticmethod
+    async def _fetch(limit: int) -> list[OutboxMessage]:
+        async with SessionLocal() as db:
+            return await get_outbox_messages(db, limit)
+
+    @staticmethod
+    async def _delete(message_ids: list[int]) -> None:
+        async with SessionLocal() as db:
+            await delete_outbox_messages(db, message_ids)
+
+    async def _relay_batch(self) -> int:
+        messages = await self._fetch(self._batch_size)
+        if not messages:
+            return 0
+
+        # Declaring may reopen the channel, which would fail the confirms still pending on it
+        for message in messages:
+            await self._declare(message.queue, message.publisher_args)
+
+        results = await asyncio.gather(
+            *[self._timed_publish(message) for message in messages],
+            return_exceptions=True,
+        )
+
+        # Only the confirmed head of the batch is deleted, so a retry keeps the order
+        confirmed_ids: list[int] = []
+        error: Optional[BaseException] = None
+        for message, result in zip(messages, results):
+            if isinstance(result, BaseException):
+                PUBLISH_FAILURES.inc(message.call_site)
+                error = error or result
+                continue
+            PUBLISH_DURATION.observe(result, message.call_site)
+            if error is None:
+                confirmed_ids.append(message.id)
+
+        if confirmed_ids:
+            await self._delete(confirmed_ids)
+        if error is not None:
+            raise error
+        return len(messages)
+
+    async def _relay(self) -> None:
+        await self._connect()
+        while True:
+            while await self._relay_batch() == self._batch_size:
+                pass
+            if self._stopping.is_set():
+                return
+            await asyncio.to_thread(OUTBOX.wait, self._poll_interval)
+
+    async def run(self) -> None:
+        logger.info(
+            "[LOG:OUTBOX_RELAY] - Relaying the outbox in batches of up to %d messages",
+            self._batch_size,
+        )
+        while not self._stopping.is_set():
+            try:
+                await self._relay()
+            except (AMQPConnectionError, ConnectionError) as e:
+                logger.warning(
+                    "[LOG:OUTBOX_RELAY] - Connection lost, reconnecting in %ss: %s",
+                    self.RECONNECT_DELAY,
+                    e,
+                )
+            except Exception as e:
+                logger.error(
+                    "[LOG:OUTBOX_RELAY] - Relay crashed, restarting in %ss: %s",
+                    self.RECONNECT_DELAY,
+                    e,
+                    exc_info=True,
+                )
+            finally:
+                await self._disconnect()
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.RECONNECT_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._task = asyncio.create_task(self.run(), name=self.TASK_NAME)
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Publish what is left in the outbox (if the broker is reachable) and stop."""
+        self._stopping.set()
+        OUTBOX.notify()
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "[LOG:OUTBOX_RELAY] - Outbox not relayed within %ss, left for the next start",
+                timeout,
+            )
+        self._task = None
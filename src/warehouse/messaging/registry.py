@@ -0,0 +1,64 @@
+from ..metrics import instrument_handler
+from chassis.messaging import (
+    MessageType,
+    register_queue_handler as chassis_register_queue_handler,
+)
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Optional,
+)
+
+MessageHandler = Callable[[MessageType], Awaitable[None] | None]
+BatchHandler = Callable[[list[MessageType]], Awaitable[None]]
+
+@dataclass(frozen=True)
+class QueueBinding:
+    queue: str
+    handler: MessageHandler
+    exchange: Optional[str] = None
+    exchange_type: Optional[str] = None
+    routing_key: Optional[str] = None
+
+
+QUEUE_BINDINGS: Dict[str, QueueBinding] = {}
+BATCH_HANDLERS: Dict[str, BatchHandler] = {}
+
+def register_queue_handler(
+    queue: str,
+    exchange: Optional[str] = None,
+    exchange_type: Optional[str] = None,
+    routing_key: Optional[str] = None,
+) -> Callable[[MessageHandler], MessageHandler]:
+    """
+    Same as `chassis.messaging.register_queue_handler`, but also remembers the
+    binding so consumers other than the chassis listener can serve the queue.
+    """
+    binding_args: dict[str, Any] = {
+        name: value
+        for name, value in (
+            ("exchange", exchange),
+            ("exchange_type", exchange_type),
+            ("routing_key", routing_key),
+        )
+        if value is not None
+    }
+
+    def decorator(handler: MessageHandler) -> MessageHandler:
+        instrumented_handler = instrument_handler(queue, handler)
+        QUEUE_BINDINGS[queue] = QueueBinding(queue=queue, handler=instrumented_handler, **binding_args)
+        chassis_register_queue_handler(queue, **binding_args)(instrumented_handler)
+        return handler
+
+    return decorator
+
+def register_batch_handler(queue: str) -> Callable[[BatchHandler], BatchHandler]:
+    """Register a handler that applies many messages of `queue` at once."""
+    def decorator(handler: BatchHandler) -> BatchHandler:
+        BATCH_HANDLERS[queue] = instrument_handler(f"{queue}:batch", handler)
+        return handler
+
+    return decorator
@@ -0,0 +1,361 @@
+from abc import (
+    ABC,
+    abstractmethod,
+)
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Optional,
+    ParamSpec,
+    TypeVar,
+)
+import asyncio
+import inspect
+import time
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+LabelValues = tuple[str, ...]
+
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+def _escape_label_value(value: str) -> str:
+    # Label values of the text exposition format escape backslash, double quote and newline
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric(ABC):
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self._lock = Lock()
+        REGISTRY.append(self)
+
+    @abstractmethod
+    def _samples(self) -> list[str]:
+        """The sample lines of the metric, in the text exposition format."""
+
+    def render(self) -> str:
+        return "\n".join([
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.TYPE}",
+            *self._samples(),
+        ])
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+            for labels, value in sorted(values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """Gauge set by the code, or read from `callback` at scrape time."""
+    TYPE = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        callback: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self.callback = callback
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def _samples(self) -> list[str]:
+        if self.callback is not None:
+            values = self.callback()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+            for labels, value in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self._buckets = buckets
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[LabelValues, list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            if (series := self._values.get(labels)) is None:
+                series = self._values[labels] = [0.0] * (len(self._buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = {labels: list(series) for labels, series in self._values.items()}
+
+        samples: list[str] = []
+        for labels, series in sorted(values.items()):
+            cumulative = 0.0
+            for bound, count in zip((*self._buckets, float("inf")), series):
+                cumulative += count
+                le_label = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                samples.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, labels, le_label)} "
+                    f"{_format_value(cumulative)}"
+                )
+            samples.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {series[-1]!r}")
+            samples.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {_format_value(cumulative)}")
+        return samples
+
+
+REGISTRY: list[_Metric] = []
+
+def render_metrics() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+class MetricsServer:
+    """
+    Answers any HTTP request on a port of its own with `render_metrics()`.
+
+    The registry is per process: under the supervisor, `/warehouse/metrics` only
+    shows the counters of the HTTP process that took the request, so every process
+    also serves its own registry here to be scraped one by one.
+    """
+
+    def __init__(self) -> None:
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @staticmethod
+    async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = render_metrics().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                b"Content-Length: %d\r\n"
+                b"Connection: close\r\n\r\n" % len(body)
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, port: int) -> None:
+        if self._server is None:
+            self._server = await asyncio.start_server(self._handle, host="0.0.0.0", port=port)
+
+    async def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+
+METRICS_SERVER = MetricsServer()
+
+
+# Hot-path instruments #############################################################################
+HANDLER_DURATION = Histogram(
+    "warehouse_handler_duration_seconds",
+    "Time spent handling one queue message (or one batch).",
+    ("queue", "outcome"),
+)
+MESSAGES_IN_FLIGHT = Gauge(
+    "warehouse_messages_in_flight",
+    "Queue messages currently being handled.",
+    ("queue",),
+)
+QUERY_DURATION = Histogram(
+    "warehouse_crud_duration_seconds",
+    "Duration of sql.crud functions.",
+    ("function",),
+)
+QUERY_ERRORS = Counter(
+    "warehouse_crud_errors_total",
+    "sql.crud calls that raised.",
+    ("function",),
+)
+PUBLISH_DURATION = Histogram(
+    "warehouse_publish_duration_seconds",
+    "Duration of RabbitMQ publishes.",
+    ("call_site",),
+)
+PUBLISH_FAILURES = Counter(
+    "warehouse_publish_failures_total",
+    "RabbitMQ publishes that failed after the reconnect retry.",
+    ("call_site",),
+)
+JWT_CACHE_LOOKUPS = Counter(
+    "warehouse_jwt_cache_lookups_total",
+    "Bearer token verifications, by verified-token cache result.",
+    ("result",),
+)
+IDEMPOTENCY_LOOKUPS = Counter(
+    "warehouse_idempotency_lookups_total",
+    "Idempotency key checks of incoming messages, by where the key was found.",
+    ("result",),
+)
+ARCHIVED_PIECES = Counter(
+    "warehouse_archived_pieces_total",
+    "Pieces moved from w_piece to w_piece_archive.",
+)
+ARCHIVE_DURATION = Histogram(
+    "warehouse_archive_run_seconds",
+    "Time spent by one archiver run, by task.",
+    ("task",),
+)
+LOG_RECORDS_DROPPED = Counter(
+    "warehouse_log_records_dropped_total",
+    "Log records dropped instead of blocking the caller, by pipeline and reason.",
+    ("pipeline", "reason"),
+)
+DB_POOL_CHECKOUT_DURATION = Histogram(
+    "warehouse_db_pool_checkout_seconds",
+    "Time spent waiting for a database connection from the pool.",
+)
+
+def instrument_query(func: Callable[P, Any]) -> Callable[P, Any]:
+    """Record duration and failures of an async crud function."""
+    name = func.__name__
+
+    @wraps(func)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> Any:
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            QUERY_ERRORS.inc(name)
+            raise
+        finally:
+            QUERY_DURATION.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+def instrument_handler(queue: str, handler: Callable[P, R]) -> Callable[P, R]:
+    """Record latency, outcome and in-flight count of a (sync or async) queue handler."""
+    if inspect.iscoroutinefunction(handler):
+        @wraps(handler)
+        async def async_wrapper(*args: P.args, **kwargs: P.kwargs) -> Any:
+            MESSAGES_IN_FLIGHT.inc(queue)
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await handler(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                MESSAGES_IN_FLIGHT.dec(queue)
+                HANDLER_DURATION.observe(time.perf_counter() - started, queue, outcome)
+
+        return async_wrapper  # type: ignore[return-value]
+
+    @wraps(handler)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        MESSAGES_IN_FLIGHT.inc(queue)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = handler(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            MESSAGES_IN_FLIGHT.dec(queue)
+            HANDLER_DURATION.observe(time.perf_counter() - started, queue, outcome)
+
+    return wrapper
+
+def instrument_pool(engine: Any) -> None:
+    """
+    Time connection checkouts of the engine pool and expose its occupancy.
+
+    `Engine.raw_connection()` goes through `pool.connect()`, so wrapping it on the
+    pool instance measures how long callers wait for a connection.
+    """
+    pool = engine.sync_engine.pool
+    if getattr(pool, "_warehouse_instrumented", False):
+        return
+    pool._warehouse_instrumented = True
+    connect = pool.connect
+
+    def timed_connect() -> Any:
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            DB_POOL_CHECKOUT_DURATION.observe(time.perf_counter() - started)
+
+    pool.connect = timed_connect
+
+    def pool_status() -> Dict[LabelValues, float]:
+        status: Dict[LabelValues, float] = {}
+        for state in ("checkedout", "checkedin", "overflow", "size"):
+            if callable(getter := getattr(pool, state, None)):
+                status[(state,)] = float(getter())
+        return status
+
+    Gauge(
+        "warehouse_db_pool_connections",
+        "Database pool occupancy, sampled at scrape time.",
+        ("state",),
+        callback=pool_status,
+    )
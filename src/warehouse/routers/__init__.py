@@ -1,3 +1,4 @@
+from .inventory_router import InventoryRouter
 from .main_router import Router
 from typing import (
     List,
@@ -5,5 +6,6 @@ from typing import (
 )
 
 __all__: List[LiteralString] = [
-    "Router"
-]
\ No newline at end of file
+    "InventoryRouter",
+    "Router",
+]
@@ -0,0 +1,116 @@
+from ..security import JWT_VERIFIER
+from ..sql import (
+    CapacitySchema,
+    get_capacity_usage,
+    get_order_pieces_page,
+    get_stock_summary,
+    Piece,
+    PiecePageSchema,
+    PieceSchema,
+    StockLevelSchema,
+)
+from chassis.sql import SessionLocal
+from fastapi import (
+    APIRouter,
+    Depends,
+    Query,
+)
+from fastapi.responses import StreamingResponse
+from typing import (
+    AsyncIterator,
+    Optional,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+InventoryRouter = APIRouter(
+    prefix="/warehouse",
+    tags=["Warehouse"],
+    dependencies=[Depends(JWT_VERIFIER)],
+)
+
+STREAM_PAGE_SIZE = 500
+
+def _piece_schema(piece: Piece) -> PieceSchema:
+    return PieceSchema(
+        id=piece.id,
+        order_id=piece.order_id,
+        type=piece.type,
+        status=piece.status,
+    )
+
+async def _stream_order_pieces(order_id: int, after_id: int) -> AsyncIterator[str]:
+    # One short session per page, so a slow client never holds a transaction open
+    while True:
+        async with SessionLocal() as db:
+            pieces = await get_order_pieces_page(db, order_id, after_id, STREAM_PAGE_SIZE)
+        for piece in pieces:
+            yield _piece_schema(piece).model_dump_json() + "\n"
+        if len(pieces) < STREAM_PAGE_SIZE:
+            return
+        after_id = pieces[-1].id
+
+
+@InventoryRouter.get(
+    "/stock",
+    summary="Piece counts per type, status and assignment",
+    response_model=list[StockLevelSchema],
+)
+async def stock(
+    piece_type: Optional[str] = Query(default=None, alias="type"),
+    piece_status: Optional[str] = Query(default=None, alias="status"),
+):
+    async with SessionLocal() as db:
+        stock_levels = await get_stock_summary(db, piece_type, piece_status)
+    return [
+        StockLevelSchema(
+            type=stock_level.type,
+            status=stock_level.status,
+            free=stock_level.free,
+            count=stock_level.count,
+        )
+        for stock_level in stock_levels
+    ]
+
+@InventoryRouter.get(
+    "/capacity",
+    summary="Reserved and available space per warehouse",
+    response_model=list[CapacitySchema],
+)
+async def capacity():
+    async with SessionLocal() as db:
+        capacity_usage = await get_capacity_usage(db)
+    return [
+        CapacitySchema(
+            warehouse_id=warehouse_id,
+            reserved=reserved,
+            capacity=capacity,
+            available=capacity - reserved,
+        )
+        for warehouse_id, capacity, reserved in capacity_usage
+    ]
+
+@InventoryRouter.get(
+    "/orders/{order_id}/pieces",
+    summary="Pieces of an order, paginated by id or streamed as NDJSON",
+    response_model=PiecePageSchema,
+)
+async def order_pieces(
+    order_id: int,
+    after_id: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=1, le=1000),
+    stream: bool = Query(default=False, description="Stream every piece as NDJSON, ignoring 'limit'"),
+):
+    if stream:
+        return StreamingResponse(
+            _stream_order_pieces(order_id, after_id),
+            media_type="application/x-ndjson",
+        )
+
+    async with SessionLocal() as db:
+        pieces = await get_order_pieces_page(db, order_id, after_id, limit)
+    return PiecePageSchema(
+        pieces=[_piece_schema(piece) for piece in pieces],
+        next_after_id=pieces[-1].id if len(pieces) == limit else None,
+    )
@@ -1,19 +1,17 @@
-from ..global_vars import (
-    RABBITMQ_CONFIG,
-    PUBLIC_KEY,
+from ..health import (
+    HEALTH_PROBER,
+    HealthSnapshot,
 )
-from ..sql import Message
-from chassis.messaging import is_rabbitmq_healthy
-from chassis.routers import (
-    get_system_metrics,
-    raise_and_log_error,
-)
-from chassis.security import create_jwt_verifier
+from ..metrics import render_metrics
+from ..security import JWT_VERIFIER
+from ..sql import HealthMessage
+from chassis.routers import raise_and_log_error
 from fastapi import (
     APIRouter,
     Depends,
     status,
 )
+from fastapi.responses import PlainTextResponse
 import logging
 import socket
 
@@ -21,37 +19,57 @@ logger = logging.getLogger(__name__)
 
 Router = APIRouter(prefix="/warehouse", tags=["Warehouse"])
 
+def _health_snapshot() -> HealthSnapshot:
+    snapshot = HEALTH_PROBER.snapshot
+    if snapshot is None or snapshot.age > HEALTH_PROBER.max_age:
+        raise_and_log_error(
+            logger=logger,
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            message="[LOG:REST] - No recent health probe",
+        )
+    assert snapshot is not None
+    return snapshot
+
 
 @Router.get(
     "/health",
     summary="Health check endpoint",
-    response_model=Message,
+    response_model=HealthMessage,
 )
 async def health_check():
-    if not is_rabbitmq_healthy(RABBITMQ_CONFIG):
+    snapshot = _health_snapshot()
+    if not snapshot.rabbitmq:
         raise_and_log_error(
             logger=logger,
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             message="[LOG:REST] - RabbitMQ not reachable",
         )
+    if not snapshot.database:
+        raise_and_log_error(
+            logger=logger,
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            message="[LOG:REST] - Database not reachable",
+        )
 
     container_id = socket.gethostname()
     logger.debug(f"[LOG:REST] - GET '/warehouse/health' served by {container_id}")
 
     return {
         "detail": f"OK - Served by {container_id}",
-        "system_metrics": get_system_metrics(),
+        "system_metrics": snapshot.system_metrics,
+        "snapshot_age_seconds": round(snapshot.age, 3),
     }
 
 @Router.get(
     "/health/auth",
     summary="Health check endpoint (JWT protected)",
-    response_model=Message,
+    response_model=HealthMessage,
 )
 async def health_check_auth(
-    token_data: dict = Depends(create_jwt_verifier(lambda: PUBLIC_KEY["key"], logger))
+    token_data: dict = Depends(JWT_VERIFIER)
 ):
     logger.debug("[LOG:REST] - GET '/warehouse/health/auth' endpoint called.")
+    snapshot = _health_snapshot()
 
     user_id = token_data.get("sub")
     user_role = token_data.get("role")
@@ -67,5 +85,21 @@ async def health_check_auth(
             "Warehouse service is running. "
             f"Authenticated as (id={user_id}, role={user_role})"
         ),
-        "system_metrics": get_system_metrics(),
-    }
\ No newline at end of file
+        "system_metrics": snapshot.system_metrics,
+        "snapshot_age_seconds": round(snapshot.age, 3),
+    }
+
+@Router.get(
+    "/metrics",
+    summary="Prometheus metrics endpoint",
+    description=(
+        "Metrics of the process that serves the request. Under the supervisor every "
+        "process also serves its own on WAREHOUSE_METRICS_PORT + its slot."
+    ),
+    response_class=PlainTextResponse,
+)
+async def metrics():
+    return PlainTextResponse(
+        render_metrics(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
\ No newline at end of file
@@ -0,0 +1,15 @@
+from .jwt_verifier import (
+    JWT_VERIFIER,
+    JWTVerifier,
+)
+from .public_key import (
+    PUBLIC_KEY_FETCHER,
+    PublicKeyFetcher,
+)
+
+__all__: list[str] = [
+    "JWT_VERIFIER",
+    "JWTVerifier",
+    "PUBLIC_KEY_FETCHER",
+    "PublicKeyFetcher",
+]
@@ -0,0 +1,127 @@
+from ..global_vars import (
+    JWT_VERIFIER_CONFIG,
+    JWTVerifierConfig,
+    PUBLIC_KEY,
+)
+from ..metrics import JWT_CACHE_LOOKUPS
+from chassis.routers import raise_and_log_error
+from collections import OrderedDict
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from fastapi import (
+    Depends,
+    status,
+)
+from fastapi.security import (
+    HTTPAuthorizationCredentials,
+    HTTPBearer,
+)
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Optional,
+)
+import hashlib
+import jwt
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class JWTVerifier:
+    """
+    FastAPI dependency that verifies bearer tokens against the auth public key.
+
+    The PEM is parsed once per key instead of on every request, and verified
+    tokens are kept in an LRU cache keyed by the SHA-256 of the token, until their
+    `exp` (and at most `cache_ttl_s`). A repeated token therefore costs a hash and
+    a dict lookup instead of a signature verification. The cache is dropped when
+    the key changes, either through `invalidate` or when `get_public_key` returns
+    a different PEM.
+    """
+
+    def __init__(self, get_public_key: Callable[[], Optional[str]], config: JWTVerifierConfig) -> None:
+        self._get_public_key = get_public_key
+        self._algorithms = config["algorithms"]
+        self._max_entries = max(0, config["cache_max_entries"])
+        self._ttl = config["cache_ttl_s"]
+        self._lock = Lock()
+        self._pem: Optional[str] = None
+        self._key: Any = None
+        # sha256(token) -> (expires_at, claims)
+        self._cache: OrderedDict[bytes, tuple[float, dict[str, Any]]] = OrderedDict()
+
+    def _public_key(self) -> Any:
+        pem = self._get_public_key()
+        if pem is None:
+            return None
+        with self._lock:
+            if pem != self._pem:
+                self._key = load_pem_public_key(pem.encode())
+                self._pem = pem
+                self._cache.clear()
+            return self._key
+
+    def _cached(self, token_hash: bytes) -> Optional[dict[str, Any]]:
+        with self._lock:
+            if (entry := self._cache.get(token_hash)) is None:
+                return None
+            expires_at, claims = entry
+            if expires_at <= time.time():
+                del self._cache[token_hash]
+                return None
+            self._cache.move_to_end(token_hash)
+            return claims
+
+    def _store(self, token_hash: bytes, claims: dict[str, Any]) -> None:
+        if self._max_entries == 0:
+            return
+        expires_at = time.time() + self._ttl
+        if isinstance(exp := claims.get("exp"), (int, float)):
+            expires_at = min(expires_at, float(exp))
+        with self._lock:
+            self._cache[token_hash] = (expires_at, claims)
+            self._cache.move_to_end(token_hash)
+            while len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """Forget the parsed key and every verified token (e.g. after a key rotation)."""
+        with self._lock:
+            self._pem = None
+            self._key = None
+            self._cache.clear()
+
+    def verify(self, token: str) -> dict[str, Any]:
+        if (key := self._public_key()) is None:
+            raise_and_log_error(
+                logger=logger,
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                message="[LOG:REST] - Public key not available yet",
+            )
+
+        token_hash = hashlib.sha256(token.encode()).digest()
+        if (claims := self._cached(token_hash)) is not None:
+            JWT_CACHE_LOOKUPS.inc("hit")
+            return dict(claims)
+        JWT_CACHE_LOOKUPS.inc("miss")
+
+        try:
+            claims = jwt.decode(token, key, algorithms=self._algorithms)
+        except jwt.PyJWTError as e:
+            raise_and_log_error(
+                logger=logger,
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                message=f"[LOG:REST] - Invalid token: {e}",
+            )
+        self._store(token_hash, claims)
+        return dict(claims)
+
+    async def __call__(
+        self,
+        credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer()),
+    ) -> dict[str, Any]:
+        return self.verify(credentials.credentials)
+
+
+JWT_VERIFIER = JWTVerifier(lambda: PUBLIC_KEY["key"], JWT_VERIFIER_CONFIG)
@@ -0,0 +1,129 @@
+from ..global_vars import (
+    PUBLIC_KEY,
+    PUBLIC_KEY_FETCH_CONFIG,
+    PublicKeyFetchConfig,
+)
+from .jwt_verifier import JWT_VERIFIER
+from chassis.consul import CONSUL_CLIENT
+from typing import Optional
+import asyncio
+import logging
+import random
+import requests
+import time
+
+logger = logging.getLogger(__name__)
+
+class PublicKeyFetcher:
+    """
+    Keeps `PUBLIC_KEY["key"]` up to date with the auth service.
+
+    Fetches run as tasks on the app event loop, with the blocking Consul lookup and
+    HTTP request in worker threads, so neither the loop nor a consumer thread waits
+    for the auth service. The Consul address is cached for `discovery_ttl_s` (and
+    forgotten when a fetch fails), and failed fetches are retried with exponential
+    backoff and jitter. Concurrent refresh requests share one fetch.
+    """
+
+    def __init__(self, config: PublicKeyFetchConfig) -> None:
+        self._request_timeout = config["request_timeout_s"]
+        self._retries = max(1, config["retries"])
+        self._backoff_base = config["backoff_base_ms"] / 1000
+        self._backoff_max = config["backoff_max_ms"] / 1000
+        self._discovery_ttl = config["discovery_ttl_s"]
+        self._prefetch_timeout = config["prefetch_timeout_s"]
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._auth_url: Optional[str] = None
+        self._auth_url_expires_at = 0.0
+
+    async def _discover_auth(self) -> str:
+        if self._auth_url is not None and time.monotonic() < self._auth_url_expires_at:
+            return self._auth_url
+
+        auth_base_url = await asyncio.to_thread(CONSUL_CLIENT.discover_service, "auth")
+        assert auth_base_url is not None, "The 'auth' service should be accesible"
+        address, port = auth_base_url
+        self._auth_url = f"{address}:{port}"
+        self._auth_url_expires_at = time.monotonic() + self._discovery_ttl
+        return self._auth_url
+
+    async def _fetch_once(self) -> str:
+        auth_url = await self._discover_auth()
+        response = await asyncio.to_thread(
+            requests.get, f"{auth_url}/auth/key", timeout=self._request_timeout
+        )
+        assert response.status_code == 200, (
+            f"Public key request returned '{response.status_code}', should return '200'"
+        )
+        new_key = response.json().get("public_key")
+        assert new_key is not None, (
+            "Auth response did not contain expected 'public_key' field."
+        )
+        return str(new_key)
+
+    async def fetch(self) -> str:
+        attempt = 0
+        while True:
+            try:
+                return await self._fetch_once()
+            except Exception as e:
+                self._auth_url = None
+                attempt += 1
+                if attempt >= self._retries:
+                    raise
+                delay = min(self._backoff_max, self._backoff_base * 2 ** (attempt - 1))
+                delay *= random.uniform(0.5, 1.0)
+                logger.warning("[LOG:PUBLIC_KEY] - Fetch failed, retrying in %.2fs: %s", delay, e)
+                await asyncio.sleep(delay)
+
+    async def refresh(self) -> bool:
+        """Fetch the key into `PUBLIC_KEY["key"]` and return whether it succeeded."""
+        try:
+            PUBLIC_KEY["key"] = await self.fetch()
+        except Exception as e:
+            logger.error("[LOG:PUBLIC_KEY] - Could not fetch the public key: %s", e, exc_info=True)
+            return False
+        JWT_VERIFIER.invalidate()
+        logger.info("[EVENT:PUBLIC_KEY:UPDATED] - Public key updated: key=%s", PUBLIC_KEY["key"])
+        return True
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+        return self._refresh_task
+
+    async def prefetch(self) -> None:
+        """
+        Bind to the running loop and fetch the key, waiting at most `prefetch_timeout_s`.
+
+        Raises when no key was loaded, so the startup phase is retried. A fetch that
+        takes longer goes on in the background and the retry waits for it again.
+        """
+        self._loop = asyncio.get_running_loop()
+        task = self._start_refresh()
+        await asyncio.wait({task}, timeout=self._prefetch_timeout)
+        if not task.done():
+            raise TimeoutError(f"Public key not fetched after {self._prefetch_timeout}s")
+        if not task.result():
+            raise RuntimeError("Public key could not be fetched")
+
+    def request_refresh(self) -> None:
+        """Schedule a refresh from any thread, without waiting for it."""
+        if self._loop is None or self._loop.is_closed():
+            # Nothing to refresh yet: `prefetch` fetches the current key when it runs
+            logger.info("[LOG:PUBLIC_KEY] - Refresh requested before prefetch, ignored")
+            return
+        self._loop.call_soon_threadsafe(self._start_refresh)
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+        self._loop = None
+
+
+PUBLIC_KEY_FETCHER = PublicKeyFetcher(PUBLIC_KEY_FETCH_CONFIG)
@@ -1,39 +1,129 @@
 from .crud import (
+    add_outbox_messages,
+    add_processed_messages,
+    archive_pieces,
     cancel_queued_pieces_in_order,
+    claim_free_pieces,
+    count_pieces_by_status,
     create_piece,
+    create_pieces,
     create_warehouse,
+    delete_outbox_messages,
+    delete_processed_messages,
     derregister_active_pieces_from_order,
+    get_capacity_usage,
     get_free_pieces,
+    get_order_pieces_page,
+    get_order_progress,
+    get_outbox_messages,
     get_piece,
     get_pieces_by_order,
+    get_processed_messages,
+    get_reservation,
+    get_stock_summary,
     get_warehouse,
-    release_pieces,
-    reserve_pieces,
+    get_warehouses,
+    mark_order_completed,
+    mark_piece_produced,
+    mark_piece_producing,
+    mark_pieces_produced,
+    mark_pieces_producing,
+    rebalance_capacity_stripes,
+    release_order_pieces,
+    reserve_order_pieces,
     update_piece,
+    update_warehouse_capacity,
+)
+from .migrations import run_migrations
+from .sqlite import (
+    apply_sqlite_profile,
+    convert_auto_vacuum,
+)
+from .writer import (
+    DB_WRITER,
+    GroupCommitWriter,
+    WriteOperation,
 )
 from .schemas import (
+    CapacitySchema,
+    HealthMessage,
     Message,
-    OrderPieceSchema
+    OrderPieceSchema,
+    OutboxEntry,
+    PiecePageSchema,
+    PieceSchema,
+    StockLevelSchema,
 )
 from .models import (
+    CapacityStripe,
+    OrderProgress,
+    OutboxMessage,
     Piece,
+    PieceArchive,
+    ProcessedMessage,
+    Reservation,
+    SchemaVersion,
+    StockSummary,
     Warehouse,
 )
 
 __all__: list[str] = [
+    "add_outbox_messages",
+    "add_processed_messages",
+    "apply_sqlite_profile",
+    "archive_pieces",
     "cancel_queued_pieces_in_order",
+    "CapacitySchema",
+    "CapacityStripe",
+    "claim_free_pieces",
+    "convert_auto_vacuum",
+    "count_pieces_by_status",
     "create_piece",
+    "create_pieces",
     "create_warehouse",
+    "DB_WRITER",
+    "delete_outbox_messages",
+    "delete_processed_messages",
     "derregister_active_pieces_from_order",
+    "get_capacity_usage",
     "get_free_pieces",
+    "get_order_pieces_page",
+    "get_order_progress",
+    "get_outbox_messages",
     "get_piece",
     "get_pieces_by_order",
+    "get_processed_messages",
+    "get_reservation",
+    "get_stock_summary",
     "get_warehouse",
+    "get_warehouses",
+    "GroupCommitWriter",
+    "HealthMessage",
+    "mark_order_completed",
+    "mark_piece_produced",
+    "mark_piece_producing",
+    "mark_pieces_produced",
+    "mark_pieces_producing",
     "Message",
     "OrderPieceSchema",
+    "OrderProgress",
+    "OutboxEntry",
+    "OutboxMessage",
     "Piece",
+    "PieceArchive",
+    "PiecePageSchema",
+    "PieceSchema",
+    "ProcessedMessage",
     "Warehouse",
-    "release_pieces",
-    "reserve_pieces",
+    "rebalance_capacity_stripes",
+    "release_order_pieces",
+    "reserve_order_pieces",
+    "Reservation",
+    "run_migrations",
+    "SchemaVersion",
+    "StockLevelSchema",
+    "StockSummary",
     "update_piece",
+    "update_warehouse_capacity",
+    "WriteOperation",
 ]
\ No newline at end of file
@@ -1,32 +1,171 @@
+from ..metrics import instrument_query
 from .models import (
+    CapacityStripe,
+    OrderProgress,
+    OutboxMessage,
     Piece,
+    PieceArchive,
+    ProcessedMessage,
+    Reservation,
+    StockSummary,
     Warehouse,
 )
+from .schemas import OutboxEntry
 from chassis.sql import (
     get_element_by_id,
     get_list_statement_result,
     update_elements_statement_result,
 )
+from collections import Counter
+from datetime import datetime
 from sqlalchemy import (
+    case,
+    delete,
+    func,
+    insert,
     select,
     update,
 )
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 
+def _active_piece_count(order_id: int):
+    return (
+        select(func.count(Piece.id))
+            .where(Piece.order_id == order_id)
+            .where(Piece.status.in_([Piece.STATUS_PRODUCED, Piece.STATUS_PRODUCING]))
+            .scalar_subquery()
+    )
+
+def _completed_at(outstanding):
+    # Value of OrderProgress.completed_at once `outstanding` is applied
+    return case(
+        (outstanding <= 0, func.coalesce(OrderProgress.completed_at, func.now())),
+        else_=None,
+    )
+
+async def _count_stock_levels(
+    db: AsyncSession,
+    piece_type: Optional[str],
+    status: Optional[str],
+) -> list[StockSummary]:
+    # Same rows as w_stock_summary, counted from w_piece
+    free = Piece.order_id == None
+    stmt = select(Piece.type, Piece.status, free, func.count(Piece.id))
+    if piece_type is not None:
+        stmt = stmt.where(Piece.type == piece_type)
+    if status is not None:
+        stmt = stmt.where(Piece.status == status)
+    result = await db.execute(
+        stmt.group_by(Piece.type, Piece.status, free).order_by(Piece.type, Piece.status, free)
+    )
+    return [
+        StockSummary(type=level_type, status=level_status, free=level_free, count=count)
+        for level_type, level_status, level_free, count in result.all()
+    ]
+
+async def _add_outstanding_pieces(
+    db: AsyncSession,
+    order_id: int,
+    quantity: int,
+) -> None:
+    result = await db.execute(
+        update(OrderProgress)
+            .where(OrderProgress.order_id == order_id)
+            .values(
+                outstanding=OrderProgress.outstanding + quantity,
+                completed_at=_completed_at(OrderProgress.outstanding + quantity),
+            )
+    )
+    if result.rowcount == 0:
+        db.add(OrderProgress(
+            order_id=order_id,
+            outstanding=quantity,
+            completed_at=func.now() if quantity <= 0 else None,
+        ))
+        await db.flush()
+
+@instrument_query
+async def add_outbox_messages(
+    db: AsyncSession,
+    entries: list[OutboxEntry],
+) -> None:
+    """Stage messages in the outbox. Not committed: they belong to the caller's transaction."""
+    if not entries:
+        return
+
+    await db.execute(insert(OutboxMessage), [dict(entry) for entry in entries])
+
+@instrument_query
+async def add_processed_messages(
+    db: AsyncSession,
+    keys: list[str],
+    processed_at: datetime,
+) -> None:
+    """Record idempotency keys; a key recorded already raises IntegrityError."""
+    if not keys:
+        return
+
+    await db.execute(
+        insert(ProcessedMessage),
+        [{"key": key, "processed_at": processed_at} for key in keys],
+    )
+    await db.commit()
+
+@instrument_query
+async def archive_pieces(
+    db: AsyncSession,
+    completed_before: datetime,
+    limit: int,
+) -> int:
+    """
+    Move up to `limit` terminal pieces from w_piece to w_piece_archive, in id order:
+    the CANCELLED and PRODUCED pieces of the orders completed before
+    `completed_before` that hold no reservation. Free stock is never moved.
+
+    Returns the number of pieces moved.
+    """
+    archivable_orders = (
+        select(OrderProgress.order_id)
+            .where(OrderProgress.outstanding == 0)
+            .where(OrderProgress.completed_at < completed_before)
+            .where(OrderProgress.order_id.not_in(select(Reservation.order_id)))
+    )
+    piece_ids = list((await db.execute(
+        select(Piece.id)
+            .where(Piece.status.in_([Piece.STATUS_CANCELLED, Piece.STATUS_PRODUCED]))
+            .where(Piece.order_id.in_(archivable_orders))
+            .order_by(Piece.id)
+            .limit(limit)
+    )).scalars())
+    if not piece_ids:
+        return 0
+
+    await db.execute(
+        insert(PieceArchive).from_select(
+            ["id", "order_id", "type", "status"],
+            select(Piece.id, Piece.order_id, Piece.type, Piece.status).where(Piece.id.in_(piece_ids)),
+        )
+    )
+    await db.execute(delete(Piece).where(Piece.id.in_(piece_ids)))
+    await db.commit()
+    return len(piece_ids)
+
+@instrument_query
 async def cancel_queued_pieces_in_order(
     db: AsyncSession,
     order_id: int,
 ) -> list[Piece]:
-    await update_elements_statement_result(
-        db=db,
-        stmt=(
-            update(Piece)
-                .where(Piece.order_id == order_id)
-                .where(Piece.status == Piece.STATUS_QUEUED)
-                .values(status=Piece.STATUS_CANCELLED)
-        )
+    result = await db.execute(
+        update(Piece)
+            .where(Piece.order_id == order_id)
+            .where(Piece.status == Piece.STATUS_QUEUED)
+            .values(status=Piece.STATUS_CANCELLED)
     )
+    # Cancelled pieces are not outstanding any more, so the order can be archived
+    if result.rowcount > 0:
+        await _add_outstanding_pieces(db, order_id, -result.rowcount)
+    await db.commit()
     return await get_list_statement_result(
         db=db,
         stmt=(
@@ -36,6 +175,56 @@ async def cancel_queued_pieces_in_order(
         )
     )
 
+@instrument_query
+async def claim_free_pieces(
+    db: AsyncSession,
+    order_id: int,
+    piece_type: str,
+    quantity: int,
+) -> list[int]:
+    """
+    Assign up to `quantity` free PRODUCED pieces of `piece_type` to an order with a
+    single UPDATE ... WHERE id IN (subquery) ... RETURNING id.
+
+    The outer WHERE repeats the "free" conditions, so a piece claimed by a
+    concurrent consumer between the subquery and the update is never taken twice.
+    """
+    if quantity <= 0:
+        return []
+
+    free_piece_ids = (
+        select(Piece.id)
+            .where(Piece.order_id == None)
+            .where(Piece.status == Piece.STATUS_PRODUCED)
+            .where(Piece.type == piece_type)
+            .limit(quantity)
+            .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        update(Piece)
+            .where(Piece.id.in_(free_piece_ids.scalar_subquery()))
+            .where(Piece.order_id == None)
+            .where(Piece.status == Piece.STATUS_PRODUCED)
+            .values(order_id=order_id)
+            .returning(Piece.id)
+    )
+    claimed_piece_ids = list(result.scalars().all())
+    await db.commit()
+    return claimed_piece_ids
+
+@instrument_query
+async def count_pieces_by_status(
+    db: AsyncSession,
+    order_id: int,
+) -> dict[str, int]:
+    result = await db.execute(
+        select(Piece.status, func.count(Piece.id))
+            .where(Piece.order_id == order_id)
+            .group_by(Piece.status)
+    )
+    return {status: count for status, count in result.all()}
+
+@instrument_query
 async def create_piece(
     db: AsyncSession,
     order_id: int,
@@ -52,31 +241,101 @@ async def create_piece(
     await db.refresh(piece)
     return piece
 
-async def create_warehouse(db: AsyncSession, warehouse_id: int) -> Warehouse:
-    warehouse = Warehouse(id=warehouse_id, reserved=0)
+@instrument_query
+async def create_pieces(
+    db: AsyncSession,
+    order_id: int,
+    piece_types: list[str],
+) -> list[tuple[int, str]]:
+    """
+    Insert one QUEUED piece per entry of `piece_types` in a single transaction.
+
+    The rows go out as multi-row INSERT ... RETURNING statements, so the
+    (id, type) pairs are returned in no particular order.
+    """
+    if not piece_types:
+        return []
+
+    result = await db.execute(
+        insert(Piece).returning(Piece.id, Piece.type),
+        [
+            {
+                "order_id": order_id,
+                "type": piece_type,
+                "status": Piece.STATUS_QUEUED,
+            }
+            for piece_type in piece_types
+        ],
+    )
+    created_pieces = [(piece_id, piece_type) for piece_id, piece_type in result.all()]
+    await _add_outstanding_pieces(db, order_id, len(created_pieces))
+    await db.commit()
+    return created_pieces
+
+@instrument_query
+async def create_warehouse(db: AsyncSession, warehouse_id: int, capacity: int) -> Warehouse:
+    warehouse = Warehouse(id=warehouse_id, capacity=capacity)
     db.add(warehouse)
     await db.flush()
     await db.commit()
     await db.refresh(warehouse)
     return warehouse
 
+@instrument_query
+async def delete_outbox_messages(
+    db: AsyncSession,
+    message_ids: list[int],
+) -> None:
+    if not message_ids:
+        return
+
+    await db.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(message_ids)))
+    await db.commit()
+
+@instrument_query
+async def delete_processed_messages(
+    db: AsyncSession,
+    processed_before: datetime,
+) -> int:
+    """Delete the keys processed before `processed_before`."""
+    result = await (await db.connection()).execute(
+        delete(ProcessedMessage).where(ProcessedMessage.processed_at < processed_before)
+    )
+    await db.commit()
+    return result.rowcount
+
+@instrument_query
 async def derregister_active_pieces_from_order(
     db: AsyncSession,
     order_id: int,
 ) -> None:
-    await update_elements_statement_result(
-        db=db,
-        stmt=(
-            update(Piece)
-                .where(Piece.order_id == order_id)
-                .where(
-                    (Piece.status == Piece.STATUS_PRODUCED) | 
-                    (Piece.status == Piece.STATUS_PRODUCING)
-                )
-                .values(order_id=None)
-        )
+    result = await db.execute(
+        update(Piece)
+            .where(Piece.order_id == order_id)
+            .where(
+                (Piece.status == Piece.STATUS_PRODUCED) | 
+                (Piece.status == Piece.STATUS_PRODUCING)
+            )
+            .values(order_id=None)
+            .returning(Piece.status)
     )
+    producing_count = sum(1 for status in result.scalars() if status == Piece.STATUS_PRODUCING)
+    if producing_count > 0:
+        await _add_outstanding_pieces(db, order_id, -producing_count)
+    await db.commit()
 
+@instrument_query
+async def get_capacity_usage(db: AsyncSession) -> list[tuple[int, int, int]]:
+    """`(warehouse_id, capacity, reserved)` of every warehouse, adding up its stripes."""
+    result = await db.execute(
+        select(Warehouse.id, Warehouse.capacity, func.coalesce(func.sum(CapacityStripe.reserved), 0))
+            .outerjoin(CapacityStripe, CapacityStripe.warehouse_id == Warehouse.id)
+            .group_by(Warehouse.id, Warehouse.capacity)
+            .order_by(Warehouse.id)
+    )
+    return [(warehouse_id, capacity, reserved) for warehouse_id, capacity, reserved in result.all()]
+
+@instrument_query
 async def get_free_pieces(
     db: AsyncSession,
     piece_type: str,
@@ -94,6 +353,47 @@ async def get_free_pieces(
         .limit(quantity)
     )
 
+@instrument_query
+async def get_order_pieces_page(
+    db: AsyncSession,
+    order_id: int,
+    after_id: int,
+    limit: int,
+) -> list[Piece]:
+    """Pieces of an order with `id > after_id`, in id order (keyset pagination)."""
+    return await get_list_statement_result(
+        db=db,
+        stmt=(
+            select(Piece)
+                .where(Piece.order_id == order_id)
+                .where(Piece.id > after_id)
+                .order_by(Piece.id)
+                .limit(limit)
+        ),
+    )
+
+@instrument_query
+async def get_order_progress(
+    db: AsyncSession,
+    order_id: int,
+) -> Optional[OrderProgress]:
+    return await get_element_by_id(
+        db=db,
+        model=OrderProgress,
+        element_id=order_id,
+    )
+
+@instrument_query
+async def get_outbox_messages(
+    db: AsyncSession,
+    limit: int,
+) -> list[OutboxMessage]:
+    return await get_list_statement_result(
+        db=db,
+        stmt=select(OutboxMessage).order_by(OutboxMessage.id).limit(limit),
+    )
+
+@instrument_query
 async def get_piece(
     db: AsyncSession,
     piece_id: int,
@@ -104,6 +404,7 @@ async def get_piece(
         element_id=piece_id,
     )
 
+@instrument_query
 async def get_pieces_by_order(
     db: AsyncSession,
     order_id: int,
@@ -113,6 +414,55 @@ async def get_pieces_by_order(
         stmt=select(Piece).where(Piece.order_id == order_id),
     )
 
+@instrument_query
+async def get_processed_messages(
+    db: AsyncSession,
+    keys: list[str],
+    processed_since: datetime,
+) -> dict[str, datetime]:
+    """When each of the keys processed since `processed_since` was recorded, by key."""
+    if not keys:
+        return {}
+
+    result = await db.execute(
+        select(ProcessedMessage.key, ProcessedMessage.processed_at)
+            .where(ProcessedMessage.key.in_(keys))
+            .where(ProcessedMessage.processed_at >= processed_since)
+    )
+    return {key: processed_at for key, processed_at in result.all()}
+
+@instrument_query
+async def get_reservation(
+    db: AsyncSession,
+    order_id: int,
+) -> Optional[Reservation]:
+    return await get_element_by_id(
+        db=db,
+        model=Reservation,
+        element_id=order_id,
+    )
+
+@instrument_query
+async def get_stock_summary(
+    db: AsyncSession,
+    piece_type: Optional[str] = None,
+    status: Optional[str] = None,
+) -> list[StockSummary]:
+    # The triggers maintaining w_stock_summary only exist on SQLite (see migrations)
+    if db.get_bind().dialect.name != "sqlite":
+        return await _count_stock_levels(db, piece_type, status)
+
+    stmt = select(StockSummary).where(StockSummary.count > 0)
+    if piece_type is not None:
+        stmt = stmt.where(StockSummary.type == piece_type)
+    if status is not None:
+        stmt = stmt.where(StockSummary.status == status)
+    return await get_list_statement_result(
+        db=db,
+        stmt=stmt.order_by(StockSummary.type, StockSummary.status, StockSummary.free),
+    )
+
+@instrument_query
 async def get_warehouse(
     db: AsyncSession,
     warehouse_id: int,
@@ -123,38 +473,262 @@ async def get_warehouse(
         element_id=warehouse_id,
     )
 
-async def release_pieces(
+@instrument_query
+async def get_warehouses(db: AsyncSession) -> list[Warehouse]:
+    return await get_list_statement_result(
+        db=db,
+        stmt=select(Warehouse).order_by(Warehouse.id),
+    )
+
+@instrument_query
+async def mark_order_completed(
     db: AsyncSession,
-    warehouse_id: int,
-    quantity: int,
+    order_id: int,
 ) -> None:
+    """Record an order served entirely from stock as completed, like the produced ones."""
+    # Adding nothing still sets completed_at when nothing is outstanding
+    await _add_outstanding_pieces(db, order_id, 0)
+    await db.commit()
+
+@instrument_query
+async def mark_piece_produced(
+    db: AsyncSession,
+    piece_id: int,
+) -> Optional[tuple[int, int]]:
+    """
+    Mark a piece PRODUCED and decrement the outstanding counter of its order in
+    the same transaction.
+
+    Returns `(order_id, outstanding)` after the update, or None when the piece
+    has no order or was already PRODUCED (e.g. a redelivered event).
+    """
+    order_id = (await db.execute(
+        update(Piece)
+            .where(Piece.id == piece_id)
+            .where(Piece.status != Piece.STATUS_PRODUCED)
+            .values(status=Piece.STATUS_PRODUCED)
+            .returning(Piece.order_id)
+    )).scalar_one_or_none()
+
+    outstanding = None
+    if order_id is not None:
+        outstanding = (await db.execute(
+            update(OrderProgress)
+                .where(OrderProgress.order_id == order_id)
+                .values(
+                    outstanding=OrderProgress.outstanding - 1,
+                    completed_at=_completed_at(OrderProgress.outstanding - 1),
+                )
+                .returning(OrderProgress.outstanding)
+        )).scalar_one_or_none()
+    await db.commit()
+
+    if order_id is None or outstanding is None:
+        return None
+    return order_id, outstanding
+
+@instrument_query
+async def mark_piece_producing(
+    db: AsyncSession,
+    piece_id: int,
+) -> None:
+    # A PRODUCED piece never goes back, so late 'producing' events cannot reopen an order
     await update_elements_statement_result(
         db=db,
         stmt=(
-            update(Warehouse)
-                .where(Warehouse.id == warehouse_id)
-                .values(reserved=Warehouse.reserved - quantity)
+            update(Piece)
+                .where(Piece.id == piece_id)
+                .where(Piece.status != Piece.STATUS_PRODUCED)
+                .values(status=Piece.STATUS_PRODUCING)
         )
     )
 
-async def reserve_pieces(
+@instrument_query
+async def mark_pieces_produced(
     db: AsyncSession,
-    warehouse_id: int,
-    quantity: int,
-    max_capacity: int
+    piece_ids: list[int],
+) -> list[tuple[int, int]]:
+    """
+    Batch version of `mark_piece_produced`: one UPDATE for all the pieces and one
+    counter update per affected order, committed together.
+
+    Returns `(order_id, outstanding)` for every affected order.
+    """
+    if not piece_ids:
+        return []
+
+    produced_per_order = Counter(
+        order_id
+        for order_id in (await db.execute(
+            update(Piece)
+                .where(Piece.id.in_(piece_ids))
+                .where(Piece.status != Piece.STATUS_PRODUCED)
+                .values(status=Piece.STATUS_PRODUCED)
+                .returning(Piece.order_id)
+        )).scalars()
+        if order_id is not None
+    )
+
+    order_progress: list[tuple[int, int]] = []
+    for order_id, produced_count in produced_per_order.items():
+        outstanding = (await db.execute(
+            update(OrderProgress)
+                .where(OrderProgress.order_id == order_id)
+                .values(
+                    outstanding=OrderProgress.outstanding - produced_count,
+                    completed_at=_completed_at(OrderProgress.outstanding - produced_count),
+                )
+                .returning(OrderProgress.outstanding)
+        )).scalar_one_or_none()
+        if outstanding is not None:
+            order_progress.append((order_id, outstanding))
+    await db.commit()
+    return order_progress
+
+@instrument_query
+async def mark_pieces_producing(
+    db: AsyncSession,
+    piece_ids: list[int],
 ) -> None:
-    result = await (await db.connection()).execute(
-        update(Warehouse)
-            .where(Warehouse.id == warehouse_id)
-            .where(Warehouse.reserved + quantity <= max_capacity)
-            .values(reserved=Warehouse.reserved + quantity) 
+    if not piece_ids:
+        return
+
+    await update_elements_statement_result(
+        db=db,
+        stmt=(
+            update(Piece)
+                .where(Piece.id.in_(piece_ids))
+                .where(Piece.status != Piece.STATUS_PRODUCED)
+                .values(status=Piece.STATUS_PRODUCING)
+        )
     )
 
+@instrument_query
+async def rebalance_capacity_stripes(
+    db: AsyncSession,
+    warehouse_id: int,
+    stripe_count: int,
+    needed_stripe: Optional[int] = None,
+    needed: int = 0,
+) -> bool:
+    """
+    Spread the free capacity of a warehouse over its stripes `0..stripe_count-1`,
+    creating the missing ones. With `needed_stripe`, that stripe gets `needed` free
+    places before the rest is shared out.
+
+    Returns False, without changes, when the warehouse has fewer than `needed` free
+    places. Stripes beyond `stripe_count` keep their reservations but get no free
+    places, so they drain as their orders are released.
+    """
+    capacity = (await db.execute(
+        select(Warehouse.capacity).where(Warehouse.id == warehouse_id)
+    )).scalar_one()
+    reserved_per_stripe: dict[int, int] = {
+        stripe: reserved
+        for stripe, reserved in (await db.execute(
+            select(CapacityStripe.stripe, CapacityStripe.reserved)
+                .where(CapacityStripe.warehouse_id == warehouse_id)
+                .with_for_update()
+        )).all()
+    }
+
+    free = capacity - sum(reserved_per_stripe.values())
+    if needed_stripe is not None and free < needed:
+        return False
+
+    missing_stripes = [stripe for stripe in range(stripe_count) if stripe not in reserved_per_stripe]
+    if missing_stripes:
+        await db.execute(insert(CapacityStripe), [
+            {"warehouse_id": warehouse_id, "stripe": stripe, "capacity": 0, "reserved": 0}
+            for stripe in missing_stripes
+        ])
+        reserved_per_stripe.update({stripe: 0 for stripe in missing_stripes})
+
+    free_per_stripe = dict.fromkeys(reserved_per_stripe, 0)
+    if needed_stripe is not None:
+        free_per_stripe[needed_stripe] = needed
+        free -= needed
+    share, remainder = divmod(max(free, 0), stripe_count)
+    for stripe in range(stripe_count):
+        free_per_stripe[stripe] += share + (1 if stripe < remainder else 0)
+
+    for stripe, reserved in reserved_per_stripe.items():
+        await db.execute(
+            update(CapacityStripe)
+                .where(CapacityStripe.warehouse_id == warehouse_id)
+                .where(CapacityStripe.stripe == stripe)
+                .values(capacity=reserved + free_per_stripe[stripe])
+        )
+    await db.commit()
+    return True
+
+@instrument_query
+async def release_order_pieces(
+    db: AsyncSession,
+    order_id: int,
+) -> Optional[int]:
+    """
+    Give back the space reserved for an order to the warehouse it was reserved in.
+
+    Returns that warehouse id, or None when the order has no reservation (never
+    reserved, rejected, or already released).
+    """
+    reservation = (await db.execute(
+        delete(Reservation)
+            .where(Reservation.order_id == order_id)
+            .returning(Reservation.warehouse_id, Reservation.stripe, Reservation.quantity)
+    )).one_or_none()
+    if reservation is None:
+        return None
+
+    warehouse_id, stripe, quantity = reservation
+    await db.execute(
+        update(CapacityStripe)
+            .where(CapacityStripe.warehouse_id == warehouse_id)
+            .where(CapacityStripe.stripe == stripe)
+            .values(reserved=CapacityStripe.reserved - quantity)
+    )
     await db.commit()
+    return warehouse_id
 
+@instrument_query
+async def reserve_order_pieces(
+    db: AsyncSession,
+    warehouse_id: int,
+    stripe: int,
+    order_id: int,
+) -> bool:
+    """
+    Reserve space for the PRODUCED/PRODUCING pieces of an order in one capacity
+    stripe of a warehouse and record the reservation, counting the pieces in a
+    subquery of each statement.
+
+    Returns False, without changes, when the pieces do not fit in that stripe
+    (`rebalance_capacity_stripes` can then move free space into it).
+    """
+    active_piece_count = _active_piece_count(order_id)
+    result = await (await db.connection()).execute(
+        update(CapacityStripe)
+            .where(CapacityStripe.warehouse_id == warehouse_id)
+            .where(CapacityStripe.stripe == stripe)
+            .where(CapacityStripe.reserved + active_piece_count <= CapacityStripe.capacity)
+            .values(reserved=CapacityStripe.reserved + active_piece_count)
+    )
     if result.rowcount == 0:
-        raise ValueError("Warehouse capacity exceeded")
+        return False
+
+    await db.execute(
+        insert(Reservation).values(
+            order_id=order_id,
+            warehouse_id=warehouse_id,
+            stripe=stripe,
+            quantity=active_piece_count,
+        )
+    )
+    await db.commit()
+    return True
 
+@instrument_query
 async def update_piece(
     db: AsyncSession,
     piece: Piece,
@@ -178,3 +752,18 @@ async def update_piece(
                 .values(**updates)
     )
     return await get_element_by_id(db=db, model=Piece, element_id=piece_id)
+
+@instrument_query
+async def update_warehouse_capacity(
+    db: AsyncSession,
+    warehouse_id: int,
+    capacity: int,
+) -> None:
+    await update_elements_statement_result(
+        db=db,
+        stmt=(
+            update(Warehouse)
+                .where(Warehouse.id == warehouse_id)
+                .values(capacity=capacity)
+        )
+    )
@@ -0,0 +1,165 @@
+from .models import (
+    CapacityStripe,
+    OrderProgress,
+    Piece,
+    SchemaVersion,
+    StockSummary,
+    Warehouse,
+)
+from sqlalchemy import (
+    case,
+    Connection,
+    delete,
+    func,
+    insert,
+    inspect,
+    literal_column,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.ext.asyncio import AsyncEngine
+from typing import Callable
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Steps are applied in order after `Base.metadata.create_all`, so they only need to
+# cover what `create_all` does not do on an existing database (indexes, columns,
+# backfills). Every step must be idempotent: on a fresh database the schema is
+# already up to date when they run.
+def _create_piece_indexes(conn: Connection) -> None:
+    for index in Piece.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+def _backfill_order_progress(conn: Connection) -> None:
+    conn.execute(
+        insert(OrderProgress).from_select(
+            ["order_id", "outstanding"],
+            select(
+                Piece.order_id,
+                func.sum(case((Piece.status == Piece.STATUS_PRODUCED, 0), else_=1)),
+            )
+                .where(Piece.order_id != None)
+                .where(Piece.order_id.not_in(select(OrderProgress.order_id)))
+                .group_by(Piece.order_id)
+        )
+    )
+
+# One row change of w_piece moves one unit between (type, status, free) buckets
+_STOCK_SUMMARY_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS tr_w_piece_stock_insert AFTER INSERT ON w_piece
+    BEGIN
+        INSERT INTO w_stock_summary (type, status, free, count)
+        VALUES (NEW.type, NEW.status, NEW.order_id IS NULL, 1)
+        ON CONFLICT (type, status, free) DO UPDATE SET count = count + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tr_w_piece_stock_delete AFTER DELETE ON w_piece
+    BEGIN
+        UPDATE w_stock_summary SET count = count - 1
+        WHERE type = OLD.type AND status = OLD.status AND free = (OLD.order_id IS NULL);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tr_w_piece_stock_update AFTER UPDATE OF type, status, order_id ON w_piece
+    WHEN OLD.type IS NOT NEW.type
+        OR OLD.status IS NOT NEW.status
+        OR (OLD.order_id IS NULL) IS NOT (NEW.order_id IS NULL)
+    BEGIN
+        UPDATE w_stock_summary SET count = count - 1
+        WHERE type = OLD.type AND status = OLD.status AND free = (OLD.order_id IS NULL);
+        INSERT INTO w_stock_summary (type, status, free, count)
+        VALUES (NEW.type, NEW.status, NEW.order_id IS NULL, 1)
+        ON CONFLICT (type, status, free) DO UPDATE SET count = count + 1;
+    END
+    """,
+]
+
+def _create_stock_summary(conn: Connection) -> None:
+    if conn.dialect.name != "sqlite":
+        # get_stock_summary counts w_piece directly on the other dialects
+        logger.info(
+            "[LOG:WAREHOUSE] - w_stock_summary triggers are only defined for SQLite, "
+            "stock levels will be counted from w_piece"
+        )
+        return
+
+    for trigger in _STOCK_SUMMARY_TRIGGERS:
+        conn.execute(text(trigger))
+    conn.execute(delete(StockSummary))
+    conn.execute(
+        insert(StockSummary).from_select(
+            ["type", "status", "free", "count"],
+            select(Piece.type, Piece.status, Piece.order_id == None, func.count(Piece.id))
+                .group_by(Piece.type, Piece.status, Piece.order_id == None)
+        )
+    )
+
+def _add_warehouse_capacity(conn: Connection) -> None:
+    # The capacities themselves are set from the configuration by WarehouseManager.create
+    if "capacity" not in {column["name"] for column in inspect(conn).get_columns("warehouse")}:
+        conn.execute(text("ALTER TABLE warehouse ADD COLUMN capacity INTEGER NOT NULL DEFAULT 0"))
+
+def _move_reserved_to_stripes(conn: Connection) -> None:
+    # Stripe 0 takes over the whole counter; WarehouseManager.create spreads it afterwards
+    if "stripe" not in {column["name"] for column in inspect(conn).get_columns("w_reservation")}:
+        conn.execute(text("ALTER TABLE w_reservation ADD COLUMN stripe INTEGER NOT NULL DEFAULT 0"))
+    # warehouse.reserved is not mapped any more (see migration 8)
+    if "reserved" not in {column["name"] for column in inspect(conn).get_columns("warehouse")}:
+        return
+    conn.execute(
+        insert(CapacityStripe).from_select(
+            ["warehouse_id", "stripe", "capacity", "reserved"],
+            select(Warehouse.id, 0, Warehouse.capacity, literal_column("warehouse.reserved"))
+                .where(Warehouse.id.not_in(select(CapacityStripe.warehouse_id)))
+        )
+    )
+    conn.execute(text("UPDATE warehouse SET reserved = 0"))
+
+def _add_order_completed_at(conn: Connection) -> None:
+    # Orders completed before the column existed count as completed now
+    if "completed_at" not in {column["name"] for column in inspect(conn).get_columns("w_order_progress")}:
+        conn.execute(text("ALTER TABLE w_order_progress ADD COLUMN completed_at DATETIME"))
+    conn.execute(
+        update(OrderProgress)
+            .where(OrderProgress.outstanding == 0)
+            .where(OrderProgress.completed_at == None)
+            .values(completed_at=func.now())
+    )
+
+def _drop_warehouse_reserved(conn: Connection) -> None:
+    # Superseded by the w_capacity_stripe counters since migration 6
+    if "reserved" in {column["name"] for column in inspect(conn).get_columns("warehouse")}:
+        conn.execute(text("ALTER TABLE warehouse DROP COLUMN reserved"))
+
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "w_piece secondary indexes", _create_piece_indexes),
+    (2, "w_order_progress backfill", _backfill_order_progress),
+    (3, "w_piece keyset pagination index", _create_piece_indexes),
+    (4, "w_stock_summary triggers and backfill", _create_stock_summary),
+    (5, "warehouse capacity column", _add_warehouse_capacity),
+    (6, "w_capacity_stripe counters", _move_reserved_to_stripes),
+    (7, "w_order_progress completion time", _add_order_completed_at),
+    (8, "warehouse.reserved column dropped", _drop_warehouse_reserved),
+]
+
+def _apply_migrations(conn: Connection) -> None:
+    current_version = conn.execute(
+        select(func.coalesce(func.max(SchemaVersion.version), 0))
+    ).scalar_one()
+
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        logger.info("[LOG:WAREHOUSE] - Applying schema migration %d: %s", version, description)
+        migration(conn)
+        conn.execute(
+            insert(SchemaVersion).values(version=version, description=description)
+        )
+
+async def run_migrations(engine: AsyncEngine) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(_apply_migrations)
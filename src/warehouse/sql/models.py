@@ -1,18 +1,44 @@
 from chassis.sql import BaseModel
 from sqlalchemy import (
+    Boolean,
+    DateTime,
+    func,
+    Index,
     Integer,
+    JSON,
     String,
+    text,
 )
 from sqlalchemy.orm import (
     Mapped,
     mapped_column,
 )
-from typing import Optional
+from datetime import datetime
+from typing import (
+    Any,
+    Optional,
+)
 
 class Warehouse(BaseModel):
     __tablename__ = "warehouse"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    capacity: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+
+
+class CapacityStripe(BaseModel):
+    """
+    One slice of a warehouse capacity counter.
+
+    Reservations only touch one stripe, so concurrent reservations of the same
+    warehouse update different rows. The stripe capacities always add up to at most
+    the warehouse capacity.
+    """
+    __tablename__ = "w_capacity_stripe"
+
+    warehouse_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    stripe: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    capacity: Mapped[int] = mapped_column(Integer, nullable=False)
     reserved: Mapped[int] = mapped_column(Integer, nullable=False)
 
 
@@ -28,3 +54,85 @@ class Piece(BaseModel):
     order_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     type: Mapped[str] = mapped_column(String(1), nullable=False)
     status: Mapped[str] = mapped_column(String(32), nullable=False)
+
+    __table_args__ = (
+        Index("ix_w_piece_order_id_status", "order_id", "status"),
+        # Keyset pagination of the pieces of an order
+        Index("ix_w_piece_order_id_id", "order_id", "id"),
+        Index(
+            "ix_w_piece_free_produced_type",
+            "type",
+            sqlite_where=text(f"order_id IS NULL AND status = '{STATUS_PRODUCED}'"),
+            postgresql_where=text(f"order_id IS NULL AND status = '{STATUS_PRODUCED}'"),
+        ),
+    )
+
+
+class OrderProgress(BaseModel):
+    __tablename__ = "w_order_progress"
+
+    order_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    # Pieces of the order that are not PRODUCED yet
+    outstanding: Mapped[int] = mapped_column(Integer, nullable=False)
+    # When `outstanding` reached 0
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
+class OutboxMessage(BaseModel):
+    __tablename__ = "w_outbox"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    queue: Mapped[str] = mapped_column(String(255), nullable=False)
+    # Keyword arguments of the publisher: exchange, exchange_type, routing_key...
+    publisher_args: Mapped[dict[str, Any]] = mapped_column(JSON, nullable=False)
+    payload: Mapped[dict[str, Any]] = mapped_column(JSON, nullable=False)
+    call_site: Mapped[str] = mapped_column(String(64), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=func.now())
+
+
+class PieceArchive(BaseModel):
+    """Terminal pieces moved out of w_piece by the archiver."""
+    __tablename__ = "w_piece_archive"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    order_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, index=True)
+    type: Mapped[str] = mapped_column(String(1), nullable=False)
+    status: Mapped[str] = mapped_column(String(32), nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=func.now())
+
+
+class ProcessedMessage(BaseModel):
+    """Idempotency key of a handled message, so redeliveries are recognized after a restart."""
+    __tablename__ = "w_processed_message"
+
+    key: Mapped[str] = mapped_column(String(128), primary_key=True)
+    processed_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+
+class Reservation(BaseModel):
+    """Space reserved for an order, so the release goes back to the same warehouse."""
+    __tablename__ = "w_reservation"
+
+    order_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    warehouse_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    stripe: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    quantity: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+class StockSummary(BaseModel):
+    """Piece counts per type, status and assignment, kept by triggers on w_piece (SQLite only)."""
+    __tablename__ = "w_stock_summary"
+
+    type: Mapped[str] = mapped_column(String(1), primary_key=True)
+    status: Mapped[str] = mapped_column(String(32), primary_key=True)
+    # Not assigned to any order
+    free: Mapped[bool] = mapped_column(Boolean, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+class SchemaVersion(BaseModel):
+    __tablename__ = "w_schema_version"
+
+    version: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    description: Mapped[str] = mapped_column(String(128), nullable=False)
+    applied_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=func.now())
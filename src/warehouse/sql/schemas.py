@@ -1,10 +1,47 @@
 from pydantic import BaseModel
-from typing import TypedDict
+from typing import (
+    Any,
+    Optional,
+    TypedDict,
+)
 
 class Message(BaseModel):
     detail: str
     system_metrics: dict
 
+class HealthMessage(Message):
+    # Seconds since the background probe that produced this answer
+    snapshot_age_seconds: float
+
+class CapacitySchema(BaseModel):
+    warehouse_id: int
+    reserved: int
+    capacity: int
+    available: int
+
+class PieceSchema(BaseModel):
+    id: int
+    order_id: Optional[int]
+    type: str
+    status: str
+
+class PiecePageSchema(BaseModel):
+    pieces: list[PieceSchema]
+    # Pass as 'after_id' to get the next page, None on the last page
+    next_after_id: Optional[int]
+
+class StockLevelSchema(BaseModel):
+    type: str
+    status: str
+    free: bool
+    count: int
+
 class OrderPieceSchema(TypedDict):
     type: str
-    quantity: int
\ No newline at end of file
+    quantity: int
+
+class OutboxEntry(TypedDict):
+    queue: str
+    publisher_args: dict[str, Any]
+    payload: dict[str, Any]
+    call_site: str
@@ -0,0 +1,71 @@
+from ..global_vars import SQLiteConfig
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from typing import Any
+import logging
+
+logger = logging.getLogger(__name__)
+
+def apply_sqlite_profile(engine: AsyncEngine, config: SQLiteConfig) -> None:
+    """
+    Run the configured PRAGMAs on every new connection of a SQLite engine.
+
+    Must be called before the first connection is opened; other dialects are left
+    untouched.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    pragmas = [
+        # Before anything else: it has to be set before the first table is created
+        f"PRAGMA auto_vacuum={config['auto_vacuum']}",
+        f"PRAGMA journal_mode={config['journal_mode']}",
+        f"PRAGMA synchronous={config['synchronous']}",
+        f"PRAGMA busy_timeout={int(config['busy_timeout_ms'])}",
+        f"PRAGMA mmap_size={int(config['mmap_size'])}",
+        f"PRAGMA cache_size={int(config['cache_size'])}",
+    ]
+
+    def on_connect(dbapi_connection: Any, _connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    event.listen(engine.sync_engine, "connect", on_connect)
+    logger.info("[LOG:WAREHOUSE] - SQLite profile: %s", "; ".join(pragmas))
+
+# 'PRAGMA auto_vacuum' values, as set and as reported
+_AUTO_VACUUM_MODES = {"NONE": 0, "FULL": 1, "INCREMENTAL": 2}
+
+async def convert_auto_vacuum(engine: AsyncEngine, config: SQLiteConfig) -> bool:
+    """
+    Rebuild the database file with 'VACUUM' when its auto_vacuum mode is not the
+    configured one, and return whether it did.
+
+    'PRAGMA auto_vacuum' only takes effect on a new file: a database created before
+    the mode was configured keeps its old one until it is vacuumed once. This must
+    run before the service takes traffic, since 'VACUUM' locks the whole file.
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    mode = str(config["auto_vacuum"]).upper()
+    expected = _AUTO_VACUUM_MODES.get(mode, int(mode) if mode.isdigit() else None)
+    if expected is None:
+        return False
+
+    # 'VACUUM' cannot run inside a transaction
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        current = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar_one()
+        if current == expected:
+            return False
+        logger.info(
+            "[LOG:WAREHOUSE] - Converting the database to auto_vacuum=%s with a one-time VACUUM",
+            mode,
+        )
+        await conn.exec_driver_sql(f"PRAGMA auto_vacuum={mode}")
+        await conn.exec_driver_sql("VACUUM")
+    return True
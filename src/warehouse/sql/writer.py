@@ -0,0 +1,192 @@
+from ..global_vars import (
+    SQLITE_CONFIG,
+    SQLiteConfig,
+)
+from chassis.sql import Engine
+from concurrent.futures import Future
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from threading import Lock
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Optional,
+    TypeVar,
+)
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+WriteOperation = Callable[[AsyncSession], Awaitable[T]]
+PendingWrite = tuple[WriteOperation, Future]
+
+class _WriterSession(AsyncSession):
+    """Session whose `commit()` only flushes: the writer commits once per operation or group."""
+
+    async def commit(self) -> None:
+        await self.flush()
+
+    async def commit_transaction(self) -> None:
+        await super().commit()
+
+
+class GroupCommitWriter:
+    """
+    Runs DB mutations, optionally through a single writer that group-commits them.
+
+    Every operation is one transaction: the crud commits inside it only flush, and
+    the writer commits when the operation returns (or rolls back if it raises), so
+    an operation can combine several crud calls atomically.
+
+    With group commit enabled, `start` runs the writer as a task on the application
+    event loop, which then owns every write connection. Operations submitted from
+    that loop or from other threads are queued to it; it runs up to
+    `group_commit_max_batch` of them (or whatever arrives within
+    `group_commit_max_wait_ms`) in one transaction, so SQLite pays one fsync and
+    one writer-lock acquisition per group. Each operation of a group runs in its own
+    savepoint: one that raises is rolled back alone and the error only reaches its
+    caller. Otherwise, or before `start`, every operation gets its own session.
+    """
+
+    def __init__(self, config: SQLiteConfig) -> None:
+        self._enabled = config["group_commit"]
+        self._max_batch = max(1, config["group_commit_max_batch"])
+        self._max_wait = config["group_commit_max_wait_ms"] / 1000
+        self._lock = Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue[Optional[PendingWrite]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _session() -> _WriterSession:
+        return _WriterSession(bind=Engine, expire_on_commit=False)
+
+    @staticmethod
+    def _resolve(future: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        if future.cancelled():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def _next_group(
+        self,
+        queue: asyncio.Queue[Optional[PendingWrite]],
+    ) -> Optional[list[PendingWrite]]:
+        if (first := await queue.get()) is None:
+            return None
+
+        group = [first]
+        deadline = time.monotonic() + self._max_wait
+        while len(group) < self._max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    item = queue.get_nowait()
+                else:
+                    item = await asyncio.wait_for(queue.get(), remaining)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            if item is None:
+                # Shutdown requested: finish this group first
+                queue.put_nowait(None)
+                break
+            group.append(item)
+        return group
+
+    async def _run_once(self, operation: WriteOperation[T]) -> T:
+        async with self._session() as db:
+            result = await operation(db)
+            await db.commit_transaction()
+            return result
+
+    async def _run_alone(self, operation: WriteOperation, future: Future) -> None:
+        try:
+            self._resolve(future, result=await self._run_once(operation))
+        except Exception as e:
+            self._resolve(future, error=e)
+
+    async def _run_group(self, group: list[PendingWrite]) -> None:
+        outcomes: list[tuple[Future, Any, Optional[BaseException]]] = []
+        try:
+            async with self._session() as db:
+                if Engine.dialect.name == "sqlite":
+                    # pysqlite only opens a transaction before DML: without it, releasing
+                    # the first savepoint would commit on its own
+                    await db.execute(text("BEGIN IMMEDIATE"))
+                for operation, future in group:
+                    try:
+                        async with db.begin_nested():
+                            outcomes.append((future, await operation(db), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+                await db.commit_transaction()
+        except Exception as e:
+            # The commit itself failed: nothing of the group was applied
+            logger.warning(
+                "[LOG:GROUP_COMMIT] - Group of %d could not be committed: %s",
+                len(group),
+                e,
+            )
+            for _, future in group:
+                self._resolve(future, error=e)
+            return
+
+        for future, result, error in outcomes:
+            self._resolve(future, result=result, error=error)
+
+    async def _writer(self, queue: asyncio.Queue[Optional[PendingWrite]]) -> None:
+        while (group := await self._next_group(queue)) is not None:
+            if len(group) == 1:
+                await self._run_alone(*group[0])
+            else:
+                await self._run_group(group)
+
+    def start(self) -> None:
+        """Run the group-commit writer on the running event loop."""
+        if not self._enabled or self._task is not None:
+            return
+        queue: asyncio.Queue[Optional[PendingWrite]] = asyncio.Queue()
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._queue = queue
+            self._task = asyncio.create_task(self._writer(queue))
+
+    def _submit(self, write: PendingWrite) -> bool:
+        with self._lock:
+            if self._loop is None or self._queue is None:
+                return False
+            try:
+                running_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                running_loop = None
+            if running_loop is self._loop:
+                self._queue.put_nowait(write)
+            else:
+                self._loop.call_soon_threadsafe(self._queue.put_nowait, write)
+            return True
+
+    async def run(self, operation: WriteOperation[T]) -> T:
+        future: Future = Future()
+        if not self._submit((operation, future)):
+            return await self._run_once(operation)
+        return await asyncio.wrap_future(future)
+
+    async def stop(self) -> None:
+        """Apply the queued operations and stop the writer task."""
+        with self._lock:
+            loop, queue, task = self._loop, self._queue, self._task
+            self._loop = self._queue = self._task = None
+            if loop is None or queue is None or task is None:
+                return
+            # After the operations other threads already scheduled on the loop
+            loop.call_soon(queue.put_nowait, None)
+        await task
+
+
+DB_WRITER = GroupCommitWriter(SQLITE_CONFIG)
@@ -0,0 +1,76 @@
+from .global_vars import (
+    STARTUP_CONFIG,
+    StartupConfig,
+)
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    TypeVar,
+)
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class StartupPipeline:
+    """
+    Startup phases of the service, timed one by one.
+
+    `run` awaits a phase that readiness depends on. `spawn` starts a phase in the
+    background and retries it with exponential backoff until it succeeds or `stop`
+    is called, so a slow or unreachable dependency (broker, Consul...) never holds
+    the first request back.
+    """
+
+    def __init__(self, config: StartupConfig) -> None:
+        self._retry_base = config["retry_base_ms"] / 1000
+        self._retry_max = config["retry_max_ms"] / 1000
+        self._tasks: list[asyncio.Task] = []
+
+    async def run(self, name: str, phase: Callable[[], Awaitable[T]]) -> T:
+        started = time.perf_counter()
+        result = await phase()
+        logger.info("[LOG:STARTUP] - %s: done in %.1fms", name, (time.perf_counter() - started) * 1000)
+        return result
+
+    async def _retry(self, name: str, phase: Callable[[], Awaitable[Any]]) -> None:
+        delay = self._retry_base
+        attempt = 1
+        while True:
+            try:
+                await self.run(name, phase)
+                return
+            except Exception as e:
+                logger.warning(
+                    "[LOG:STARTUP] - %s: attempt %d failed, retrying in %.1fs: %s",
+                    name,
+                    attempt,
+                    delay,
+                    e,
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self._retry_max)
+            attempt += 1
+
+    def spawn(self, name: str, phase: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = asyncio.create_task(self._retry(name, phase), name=f"startup: {name}")
+        self._tasks.append(task)
+        return task
+
+    async def wait(self) -> None:
+        """Wait for every background phase to succeed."""
+        await asyncio.gather(*self._tasks)
+
+    async def stop(self) -> None:
+        """Give up on the background phases that did not succeed yet."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+STARTUP = StartupPipeline(STARTUP_CONFIG)
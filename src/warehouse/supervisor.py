@@ -0,0 +1,238 @@
+from .global_vars import (
+    RABBITMQ_CONFIG,
+    WORKER_CONFIG,
+    WorkerConfig,
+)
+from .startup import STARTUP
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import get_context
+from multiprocessing.process import BaseProcess
+from multiprocessing.synchronize import Event as ProcessEvent
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Iterator,
+    Optional,
+)
+import asyncio
+import logging
+import math
+import os
+import signal
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class WorkerRole:
+    """What the current process does, from its role and its index among the processes of that role."""
+    role: str
+    index: int
+    supervised: bool
+    # Port of the process' own metrics endpoint, see `MetricsServer`
+    metrics_port: Optional[int] = None
+
+    @property
+    def serves_http(self) -> bool:
+        return self.role in ("all", "http")
+
+    @property
+    def consumes(self) -> bool:
+        return self.role in ("all", "consumer")
+
+    @property
+    def runs_singletons(self) -> bool:
+        """Outbox relay, archiver, idempotency key pruning: one process per service."""
+        return self.consumes and self.index == 0
+
+    @property
+    def initializes(self) -> bool:
+        """Database schema and Consul registration, done by the supervisor when there is one."""
+        return not self.supervised
+
+
+def _metrics_port(config: WorkerConfig) -> Optional[int]:
+    if not config["supervised"] or not config["metrics_port"]:
+        return None
+    slot = config["index"] if config["role"] == "http" else config["http_processes"] + config["index"]
+    return config["metrics_port"] + slot
+
+WORKER_ROLE = WorkerRole(
+    role=WORKER_CONFIG["role"],
+    index=WORKER_CONFIG["index"],
+    supervised=WORKER_CONFIG["supervised"],
+    metrics_port=_metrics_port(WORKER_CONFIG),
+)
+
+@contextmanager
+def _environ(**variables: str) -> Iterator[None]:
+    # Spawned processes copy the environment when they start
+    previous = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+async def _until(event: ProcessEvent) -> None:
+    while not event.is_set():
+        await asyncio.sleep(0.1)
+
+def _run_consumer(shutdown_event: ProcessEvent, outbox_event: ProcessEvent) -> None:
+    from . import (
+        APP,
+        lifespan,
+    )
+    from .business_logic import OUTBOX
+
+    OUTBOX.share(outbox_event)
+
+    async def consume() -> None:
+        async with lifespan(APP):
+            await _until(shutdown_event)
+
+    asyncio.run(consume())
+
+
+class Supervisor:
+    """
+    Runs the HTTP and consumer processes of one container.
+
+    The supervisor initializes the database and registers in Consul once, then
+    starts `http_processes` hypercorn workers, which share the listening sockets,
+    and `consumer_processes` queue consumers, which compete for the same queues
+    with a share of the prefetch. Crashed processes are restarted. On SIGTERM or
+    SIGINT every process drains (in-flight requests and messages, outbox) for up to
+    `drain_timeout_s` before it is killed. Metrics stay per process, see
+    `WorkerConfig.metrics_port`.
+    """
+
+    def __init__(self, config: WorkerConfig) -> None:
+        self._http_processes = config["http_processes"]
+        # Somebody has to consume the queues and run the outbox relay
+        self._consumer_processes = max(1, config["consumer_processes"])
+        self._prefetch_count = config["consumer_prefetch_count"] or max(
+            1, math.ceil(RABBITMQ_CONFIG["prefetch_count"] / self._consumer_processes)
+        )
+        self._drain_timeout = config["drain_timeout_s"]
+        self._context = get_context("spawn")
+        # Created by `run`: the children import this module too
+        self._shutdown_event: Optional[ProcessEvent] = None
+        self._outbox_event: Optional[ProcessEvent] = None
+        self._processes: dict[tuple[str, int], BaseProcess] = {}
+
+    def _start(self, role: str, index: int, hypercorn_config: Any, sockets: Any) -> None:
+        assert self._shutdown_event is not None and self._outbox_event is not None
+        if role == "http":
+            from hypercorn.asyncio.run import asyncio_worker
+
+            process = self._context.Process(
+                target=asyncio_worker,
+                kwargs={"config": hypercorn_config, "sockets": sockets, "shutdown_event": self._shutdown_event},
+                name=f"warehouse-http-{index}",
+            )
+        else:
+            process = self._context.Process(
+                target=_run_consumer,
+                args=(self._shutdown_event, self._outbox_event),
+                name=f"warehouse-consumer-{index}",
+            )
+
+        variables = {
+            "WAREHOUSE_ROLE": role,
+            "WAREHOUSE_PROCESS_INDEX": str(index),
+            "WAREHOUSE_SUPERVISED": "1",
+        }
+        if role == "consumer":
+            variables["RABBITMQ_PREFETCH_COUNT"] = str(self._prefetch_count)
+        # Children leave Ctrl+C to the supervisor, which stops them through the shutdown event
+        previous_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        try:
+            with _environ(**variables):
+                process.start()
+        finally:
+            signal.signal(signal.SIGINT, previous_handler)
+        self._processes[(role, index)] = process
+        logger.info("[LOG:SUPERVISOR] - Started %s (pid %s)", process.name, process.pid)
+
+    async def _supervise(self, hypercorn_config: Any, sockets: Any) -> None:
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stopping.set)
+
+        slots = [("http", index) for index in range(self._http_processes)]
+        slots += [("consumer", index) for index in range(self._consumer_processes)]
+        for role, index in slots:
+            self._start(role, index, hypercorn_config, sockets)
+
+        while not stopping.is_set():
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            if stopping.is_set():
+                break
+            for (role, index), process in list(self._processes.items()):
+                if not process.is_alive():
+                    logger.error(
+                        "[LOG:SUPERVISOR] - %s exited with code %s, restarting it",
+                        process.name,
+                        process.exitcode,
+                    )
+                    self._start(role, index, hypercorn_config, sockets)
+
+    async def _drain(self) -> None:
+        logger.info("[LOG:SUPERVISOR] - Draining %d processes", len(self._processes))
+        if self._shutdown_event is not None:
+            self._shutdown_event.set()
+        deadline = asyncio.get_running_loop().time() + self._drain_timeout
+        for process in self._processes.values():
+            timeout = max(0.0, deadline - asyncio.get_running_loop().time())
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                logger.warning("[LOG:SUPERVISOR] - %s did not drain in time, killing it", process.name)
+                process.kill()
+                await asyncio.to_thread(process.join)
+
+    async def run(
+        self,
+        hypercorn_config: Any,
+        initialize: Callable[[], Awaitable[None]],
+        register: Callable[[], Awaitable[None]],
+        shutdown: Callable[[], Awaitable[None]],
+    ) -> None:
+        """Initialize once, run the processes until a signal arrives, then drain them and `shutdown`."""
+        logger.info(
+            "[LOG:SUPERVISOR] - Running %d HTTP and %d consumer processes (prefetch %d each)",
+            self._http_processes,
+            self._consumer_processes,
+            self._prefetch_count,
+        )
+        await STARTUP.run("Database schema", initialize)
+        STARTUP.spawn("Consul registration", register)
+
+        self._shutdown_event = self._context.Event()
+        self._outbox_event = self._context.Event()
+
+        hypercorn_config.application_path = f"{__package__}:APP"
+        sockets = hypercorn_config.create_sockets()
+        try:
+            await self._supervise(hypercorn_config, sockets)
+        finally:
+            await self._drain()
+            await STARTUP.stop()
+            await shutdown()
+
+
+SUPERVISOR: Optional[Supervisor] = (
+    Supervisor(WORKER_CONFIG)
+    if not WORKER_CONFIG["supervised"]
+    and (WORKER_CONFIG["http_processes"] > 1 or WORKER_CONFIG["consumer_processes"] > 0)
+    else None
+)
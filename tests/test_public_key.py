@@ -0,0 +1,115 @@
+"""
+`PublicKeyFetcher` against a local HTTP stub of the auth service.
+
+    python -m unittest discover tests
+"""
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from threading import Thread
+from unittest import (
+    IsolatedAsyncioTestCase,
+    mock,
+)
+from warehouse.global_vars import (
+    PUBLIC_KEY,
+    PublicKeyFetchConfig,
+)
+from warehouse.security import PublicKeyFetcher
+from warehouse.security import public_key as public_key_module
+import asyncio
+import json
+
+CONFIG: PublicKeyFetchConfig = {
+    "request_timeout_s": 1.0,
+    "retries": 2,
+    "backoff_base_ms": 1,
+    "backoff_max_ms": 5,
+    "discovery_ttl_s": 60,
+    "prefetch_timeout_s": 2.0,
+}
+
+
+class AuthStub:
+    """Serves `GET /auth/key` with `key`, or a 503 while `failing`."""
+
+    def __init__(self) -> None:
+        self.key = "key-1"
+        self.failing = False
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                stub.requests += 1
+                if stub.failing or self.path != "/auth/key":
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                body = json.dumps({"public_key": stub.key}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.address = ("http://127.0.0.1", self._server.server_address[1])
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class PublicKeyFetcherTest(IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.stub = AuthStub()
+        self.addCleanup(self.stub.close)
+        consul = mock.patch.object(
+            public_key_module.CONSUL_CLIENT, "discover_service", return_value=self.stub.address
+        )
+        consul.start()
+        self.addCleanup(consul.stop)
+        self.addCleanup(PUBLIC_KEY.__setitem__, "key", PUBLIC_KEY["key"])
+        PUBLIC_KEY["key"] = None
+        self.fetcher = PublicKeyFetcher(CONFIG)
+
+    async def asyncTearDown(self) -> None:
+        await self.fetcher.stop()
+
+    async def test_prefetch_loads_the_key(self) -> None:
+        await self.fetcher.prefetch()
+        self.assertEqual(PUBLIC_KEY["key"], "key-1")
+
+    async def test_prefetch_raises_until_the_auth_service_recovers(self) -> None:
+        self.stub.failing = True
+        with self.assertRaises(RuntimeError):
+            await self.fetcher.prefetch()
+        self.assertIsNone(PUBLIC_KEY["key"])
+        self.assertEqual(self.stub.requests, CONFIG["retries"])
+
+        self.stub.failing = False
+        await self.fetcher.prefetch()
+        self.assertEqual(PUBLIC_KEY["key"], "key-1")
+
+    async def test_request_refresh_picks_up_a_rotated_key(self) -> None:
+        await self.fetcher.prefetch()
+        self.stub.key = "key-2"
+        await asyncio.to_thread(self.fetcher.request_refresh)
+        for _ in range(100):
+            if PUBLIC_KEY["key"] == "key-2":
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(PUBLIC_KEY["key"], "key-2")
+
+    async def test_request_refresh_before_prefetch_is_ignored(self) -> None:
+        self.fetcher.request_refresh()
+        self.assertEqual(self.stub.requests, 0)
+        self.assertIsNone(PUBLIC_KEY["key"])